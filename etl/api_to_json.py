@@ -1,21 +1,120 @@
 import os
 import json
 import requests
-from datetime import date
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from etl.http_cache import RateLimiter, ResponseCache, get_scoreboard_final_after
+from etl.instrumentation import timed
 
 load_dotenv()
 
 
-def get_espn_api_scoreboard(event_date: date) -> dict:
-    scoreboard_res = requests.get(
-        url=os.getenv("ESPN_API_URL"), params={"dates": event_date.strftime("%Y%m%d")}
+def get_http_session(
+    pool_size: int = 10, max_retries: int = 3, backoff_factor: float = 0.5
+) -> requests.Session:
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
     )
-    assert scoreboard_res.status_code == 200
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    http_session = requests.Session()
+    http_session.mount("http://", adapter)
+    http_session.mount("https://", adapter)
+    return http_session
+
+
+def get_date_range(start_date: date, end_date: date) -> list[date]:
+    return [
+        start_date + timedelta(days=offset)
+        for offset in range((end_date - start_date).days + 1)
+    ]
+
+
+@timed("fetch")
+def get_espn_api_scoreboard(
+    event_date: date,
+    http_session: requests.Session | None = None,
+    api_url: str | None = None,
+    response_cache: ResponseCache | None = None,
+    rate_limiter: RateLimiter | None = None,
+    recent_max_age: float = 300,
+) -> dict:
+    scoreboard_url = os.getenv("ESPN_API_URL") if api_url is None else api_url
+    scoreboard_params = {"dates": event_date.strftime("%Y%m%d")}
+    if response_cache is not None:
+        scoreboard_content = response_cache.get(
+            url=scoreboard_url,
+            params=scoreboard_params,
+            max_age=recent_max_age,
+            http_session=http_session,
+            final_after=get_scoreboard_final_after(event_date),
+            rate_limiter=rate_limiter,
+        )
+        return json.loads(scoreboard_content)
+    if rate_limiter is not None:
+        rate_limiter.wait()
+    http_client = requests if http_session is None else http_session
+    scoreboard_res = http_client.get(url=scoreboard_url, params=scoreboard_params)
+    assert scoreboard_res.status_code == 200, f"HTTP {scoreboard_res.status_code}"
     return scoreboard_res.json()
 
 
-def get_news_api_headline(query: str) -> dict:
+def get_espn_api_scoreboards(
+    event_dates: list[date],
+    max_workers: int = 8,
+    requests_per_second: float = 5.0,
+    max_retries: int = 3,
+    api_url: str | None = None,
+    response_cache: ResponseCache | None = None,
+    failed_dates: list[date] | None = None,
+) -> Iterator[tuple[date, dict]]:
+    # a date that cannot be fetched is reported, appended to failed_dates and
+    # skipped, so one bad day does not stop the rest of the range
+    http_session = get_http_session(pool_size=max_workers, max_retries=max_retries)
+    rate_limiter = RateLimiter(requests_per_second)
+
+    def fetch_scoreboard(event_date: date) -> dict | Exception:
+        # the limiter is applied inside, cache hits do not wait for a slot
+        try:
+            return get_espn_api_scoreboard(
+                event_date, http_session, api_url, response_cache, rate_limiter
+            )
+        except Exception as fetch_error:
+            return fetch_error
+
+    # results come back in date order while later dates are still in flight
+    with http_session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for event_date, sports_scoreboard in zip(
+            event_dates, executor.map(fetch_scoreboard, event_dates)
+        ):
+            if isinstance(sports_scoreboard, Exception):
+                print(f"Scoreboard {event_date} not fetched: {sports_scoreboard!r}")
+                if failed_dates is not None:
+                    failed_dates.append(event_date)
+                continue
+            yield event_date, sports_scoreboard
+
+
+def get_news_api_headline(
+    query: str, response_cache: ResponseCache | None = None, max_age: float = 900
+) -> dict:
+    if response_cache is not None:
+        headline_content = response_cache.get(
+            url=os.getenv("NEWS_API_URL"),
+            params={"q": query},
+            headers={"X-Api-Key": os.getenv("NEWS_API_KEY")},
+            max_age=max_age,
+        )
+        return json.loads(headline_content)
     headline_res = requests.get(
         headers={"X-Api-Key": os.getenv("NEWS_API_KEY")},
         url=os.getenv("NEWS_API_URL"),
@@ -32,6 +131,7 @@ def is_event_completed(event_doc: dict) -> bool:
     return result_games[0]["status"]["type"]["completed"]
 
 
+@timed("extract")
 def extract_events(scoreboard_doc: dict) -> list:
     sports_events = scoreboard_doc["events"]
     if len(sports_events) > 1:
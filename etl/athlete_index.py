@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from collections.abc import Iterable
+
+
+class AthleteNameIndex:
+    def __init__(self, max_names: int = 200_000):
+        # name -> number of athlete nodes with that name, least recently used first
+        self.max_names = max_names
+        self.counts = OrderedDict()
+        self.multi_matches = {}
+        # complete: every athlete name in the graph is held, so a miss means absent
+        self.complete = False
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __str__(self):
+        return (
+            f"Athlete name index with {len(self.counts)} names "
+            f"({len(self.multi_matches)} multi-match, complete={self.complete})"
+        )
+
+    def set_count(self, name: str, num_match: int) -> None:
+        self.counts[name] = num_match
+        self.counts.move_to_end(name)
+        if num_match > 1:
+            self.multi_matches[name] = num_match
+        else:
+            self.multi_matches.pop(name, None)
+        if len(self.counts) > self.max_names:
+            evicted_name, _ = self.counts.popitem(last=False)
+            self.multi_matches.pop(evicted_name, None)
+            self.stats["evictions"] += 1
+            self.complete = False
+
+    def load(self, name_counts: Iterable[tuple[str, int]]) -> int:
+        num_loaded = 0
+        for name, num_match in name_counts:
+            if num_loaded >= self.max_names:
+                # stop before evicting, the rest falls back to the database
+                self.complete = False
+                return num_loaded
+            self.set_count(name, num_match)
+            num_loaded += 1
+        self.complete = True
+        return num_loaded
+
+    def lookup(self, name: str) -> int | None:
+        num_match = self.counts.get(name)
+        if num_match is not None:
+            self.counts.move_to_end(name)
+            self.stats["hits"] += 1
+            return num_match
+        if self.complete:
+            self.stats["hits"] += 1
+            return 0
+        self.stats["misses"] += 1
+        return None
+
+    def add_merged(self, name: str) -> None:
+        # MERGE on name creates a node only when none matched
+        if not self.counts.get(name):
+            self.set_count(name, 1)
@@ -0,0 +1,484 @@
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+import pandas as pd
+from collections import Counter
+from datetime import date, datetime
+from langchain_core.messages import AIMessage
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import RunnableLambda
+from neo4j import Record, SummaryCounters
+from etl.graphs import GraphNeo4j, GraphNetworkx
+from etl.instrumentation import get_query_key
+from etl.json_to_pydantic import GraphPydanticChain, GraphPydanticManual
+from etl.models import GraphSports
+from etl.networkx_analysis import detect_community_agent_athlete
+from etl.pydantic_to_neo4j import build_graph, build_graph_batch
+from etl.table_to_neo4j import update_graph_from_df
+
+REPORT_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "reports")
+PROMPT_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "prompts", "json_to_graph_sports.md"
+)
+STATS_NAMES = ["points", "rebounds", "assists", "steals", "blocks", "turnovers"]
+
+
+def generate_event(
+    game_index: int, num_leaders: int = 3, event_date: date = date(2025, 2, 21)
+) -> dict:
+    # same shape as one entry of get_espn_api_scoreboard(...)["events"]
+    game_id = str(400000000 + game_index)
+    event_time = f"{event_date}T00:30Z"
+    competitors = []
+    for home_or_away, team_id in [
+        ("home", 2 * game_index + 1),
+        ("away", 2 * game_index + 2),
+    ]:
+        # leaders are drawn from a 5-man rotation, so athletes repeat across stats
+        leaders = [{"name": "rating", "leaders": []}]
+        for leader_index in range(num_leaders):
+            athlete_index = leader_index % 5
+            leaders.append(
+                {
+                    "name": STATS_NAMES[leader_index % len(STATS_NAMES)]
+                    + ("" if leader_index < len(STATS_NAMES) else f"_{leader_index}"),
+                    "leaders": [
+                        {
+                            "value": float(10 + leader_index),
+                            "athlete": {
+                                "id": str(team_id * 100 + athlete_index),
+                                "fullName": f"Athlete {team_id} {athlete_index}",
+                                "shortName": f"A. {team_id}{athlete_index}",
+                                "jersey": str(athlete_index),
+                            },
+                        }
+                    ],
+                }
+            )
+        competitors.append(
+            {
+                "homeAway": home_or_away,
+                "winner": home_or_away == "home",
+                "team": {
+                    "id": str(team_id),
+                    "displayName": f"Team {team_id}",
+                    "abbreviation": f"T{team_id}",
+                },
+                "leaders": leaders,
+            }
+        )
+    return {
+        "id": game_id,
+        "name": f"Team {2 * game_index + 2} at Team {2 * game_index + 1}",
+        "date": event_time,
+        "competitions": [
+            {
+                "id": game_id,
+                "date": event_time,
+                "competitors": competitors,
+                "status": {"type": {"completed": True}},
+            }
+        ],
+    }
+
+
+def generate_scoreboard(
+    num_games: int, num_leaders: int = 3, event_date: date = date(2025, 2, 21)
+) -> dict:
+    return {
+        "events": [
+            generate_event(game_index, num_leaders, event_date)
+            for game_index in range(num_games)
+        ]
+    }
+
+
+def generate_agents_table(
+    num_athletes: int,
+    num_agents: int | None = None,
+    max_agents: int = 3,
+    seed: int = 0,
+) -> pd.DataFrame:
+    # same shape as process_nba_agents_table output: Player, Agents (list)
+    random_generator = random.Random(seed)
+    num_agents = max(2, num_athletes // 5) if num_agents is None else num_agents
+    agency_size = 5
+    athlete_agents = []
+    for athlete_index in range(num_athletes):
+        # agents cluster into agencies, which gives Louvain something to find
+        agency_start = random_generator.randrange(0, num_agents, agency_size)
+        agency = range(agency_start, min(agency_start + agency_size, num_agents))
+        num_athlete_agents = random_generator.randint(1, min(max_agents, len(agency)))
+        agent_indexes = random_generator.sample(list(agency), num_athlete_agents)
+        athlete_agents.append(
+            {
+                "Player": f"Athlete {athlete_index}",
+                "Agents": [f"Agent {agent_index}" for agent_index in agent_indexes],
+            }
+        )
+    return pd.DataFrame(athlete_agents, columns=["Player", "Agents"])
+
+
+class RecordingSummary:
+    def __init__(self):
+        self.counters = SummaryCounters({})
+
+
+class RecordingResult:
+    def __init__(self, records: list[Record]):
+        self.records = records
+        self.summary = RecordingSummary()
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def consume(self) -> RecordingSummary:
+        return self.summary
+
+
+class RecordingTransaction:
+    def __init__(self, recording_driver: "RecordingDriver"):
+        self.recording_driver = recording_driver
+
+    def run(self, query: str, parameters: dict | None = None, **kwargs):
+        return self.recording_driver.record(query, parameters or kwargs)
+
+
+class RecordingSession:
+    def __init__(self, recording_driver: "RecordingDriver"):
+        self.recording_driver = recording_driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def run(self, query: str, parameters: dict | None = None, **kwargs):
+        return self.recording_driver.record(query, parameters or kwargs)
+
+    def execute_write(self, transaction_function, *args, **kwargs):
+        self.recording_driver.num_transactions += 1
+        return transaction_function(
+            RecordingTransaction(self.recording_driver), *args, **kwargs
+        )
+
+    execute_read = execute_write
+
+    def close(self) -> None:
+        pass
+
+
+class RecordingDriver:
+    def __init__(self, responses: dict[str, list[dict]] | None = None):
+        # responses: query substring -> records handed back for that query
+        self.responses = {
+            "timestamp() AS now": [{"now": 0}],
+            "SHOW CONSTRAINTS": [{"names": ["athlete_id", "team_id", "game_id"]}],
+        }
+        self.responses.update(responses or {})
+        self.reset()
+
+    def reset(self) -> None:
+        self.queries = Counter()
+        self.rows = Counter()
+        self.num_transactions = 0
+
+    def record(self, query: str, parameters: dict | None) -> RecordingResult:
+        query_key = get_query_key(query)
+        self.queries[query_key] += 1
+        for parameter_value in (parameters or {}).values():
+            if isinstance(parameter_value, list):
+                self.rows[query_key] += len(parameter_value)
+        for query_part, records in self.responses.items():
+            if query_part in query:
+                return RecordingResult([Record(record) for record in records])
+        return RecordingResult([])
+
+    def execute_query(
+        self, query_: str, parameters_: dict | None = None, database_=None, **kwargs
+    ) -> RecordingResult:
+        self.num_transactions += 1
+        return self.record(query_, parameters_ or kwargs)
+
+    def session(self, **session_config) -> RecordingSession:
+        return RecordingSession(self)
+
+    def verify_connectivity(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def get_stats(self) -> dict:
+        return {
+            "round_trips": sum(self.queries.values()),
+            "transactions": self.num_transactions,
+            "rows": sum(self.rows.values()),
+            "queries": dict(self.queries.most_common()),
+        }
+
+
+class RecordingChatModel:
+    def __init__(
+        self,
+        graphs_pydantic_sports: list[GraphSports],
+        input_tokens: int = 1000,
+        output_tokens: int = 200,
+    ):
+        # answers with the graph whose game id appears in the prompt, so the
+        # output matches the input whatever order batch() calls it in
+        self.graphs = {
+            str(graph_pydantic_sports.game.id): graph_pydantic_sports
+            for graph_pydantic_sports in graphs_pydantic_sports
+        }
+        self.usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.num_calls = 0
+
+    def respond(self, prompt_value: PromptValue) -> dict:
+        with self.lock:
+            self.num_calls += 1
+        prompt_text = prompt_value.to_string()
+        raw_message = AIMessage(content="", usage_metadata=self.usage_metadata)
+        for game_id, graph_pydantic_sports in self.graphs.items():
+            if game_id in prompt_text:
+                return {
+                    "raw": raw_message,
+                    "parsed": graph_pydantic_sports,
+                    "parsing_error": None,
+                }
+        return {
+            "raw": raw_message,
+            "parsed": None,
+            "parsing_error": ValueError("no known game in the input"),
+        }
+
+    def with_structured_output(
+        self, schema: type, include_raw: bool = False, **kwargs
+    ) -> RunnableLambda:
+        # same output shape as a real chat model's structured output
+        if include_raw:
+            return RunnableLambda(self.respond)
+        return RunnableLambda(lambda prompt_value: self.respond(prompt_value)["parsed"])
+
+
+def time_best(function, repeat: int = 3, setup=None) -> float:
+    best_seconds = float("inf")
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        time_start = time.perf_counter()
+        function()
+        best_seconds = min(best_seconds, time.perf_counter() - time_start)
+    return best_seconds
+
+
+def benchmark_transform_sizes(
+    sizes: list[int], num_leaders: int = 3, repeat: int = 3
+) -> list[dict]:
+    results = []
+    for num_games in sizes:
+        sports_events = generate_scoreboard(num_games, num_leaders)["events"]
+        for mode_name, fast_construct in [("per_model", False), ("fast", True)]:
+            graph_pydantic_manual = GraphPydanticManual(fast_construct=fast_construct)
+            seconds = time_best(
+                lambda: [
+                    graph_pydantic_manual.transform_graph_pydantic(sports_event)
+                    for sports_event in sports_events
+                ],
+                repeat,
+            )
+            results.append({"games": num_games, "mode": mode_name, "seconds": seconds})
+    return results
+
+
+def benchmark_build_graph_sizes(
+    sizes: list[int], num_leaders: int = 3, repeat: int = 3
+) -> list[dict]:
+    results = []
+    graph_pydantic_manual = GraphPydanticManual()
+    for num_games in sizes:
+        sports_events = generate_scoreboard(num_games, num_leaders)["events"]
+        graphs_pydantic_sports = [
+            graph_pydantic_manual.transform_graph_pydantic(sports_event)
+            for sports_event in sports_events
+        ]
+        for mode_name in ["per_entity", "batch"]:
+            recording_driver = RecordingDriver()
+            graph_db = GraphNeo4j(neo4j_driver=recording_driver)
+            if mode_name == "per_entity":
+                build_function = lambda: [
+                    build_graph(graph_db, graph_pydantic_sports)
+                    for graph_pydantic_sports in graphs_pydantic_sports
+                ]
+            else:
+                build_function = lambda: build_graph_batch(
+                    graph_db, graphs_pydantic_sports
+                )
+            # every run starts from the same team history, or the timed runs would
+            # skip the compete_for rows the warm-up already wrote
+            team_history = graph_db.load_team_history()
+
+            def reset_run():
+                recording_driver.reset()
+                graph_db.team_history = team_history.copy()
+
+            # warm-up run takes the one-off schema bootstrap out of the numbers
+            reset_run()
+            build_function()
+            seconds = time_best(build_function, repeat, reset_run)
+            results.append(
+                {"games": num_games, "mode": mode_name, "seconds": seconds}
+                | recording_driver.get_stats()
+            )
+    return results
+
+
+def benchmark_update_graph_from_df_sizes(
+    sizes: list[int], repeat: int = 3
+) -> list[dict]:
+    results = []
+    for num_athletes in sizes:
+        athlete_agents_df = generate_agents_table(num_athletes)
+        for mode_name, bulk in [("per_row", False), ("bulk", True)]:
+            recording_driver = RecordingDriver()
+            graph_db = GraphNeo4j(neo4j_driver=recording_driver)
+            update_function = lambda: update_graph_from_df(
+                athlete_agents_df, graph_db, bulk=bulk
+            )
+            update_function()
+            seconds = time_best(update_function, repeat, recording_driver.reset)
+            results.append(
+                {"athletes": num_athletes, "mode": mode_name, "seconds": seconds}
+                | recording_driver.get_stats()
+            )
+    return results
+
+
+def benchmark_detect_community_sizes(sizes: list[int], repeat: int = 1) -> list[dict]:
+    results = []
+    for num_athletes in sizes:
+        athlete_agents_df = generate_agents_table(num_athletes)
+        graph_networkx = GraphNetworkx("agent_athlete")
+        graph_networkx.add_edges(
+            [
+                (agent_name, athlete_name)
+                for athlete_name, agent_names in zip(
+                    athlete_agents_df["Player"], athlete_agents_df["Agents"]
+                )
+                for agent_name in agent_names
+            ]
+        )
+        seconds = time_best(
+            lambda: detect_community_agent_athlete(graph_networkx), repeat
+        )
+        results.append(
+            {
+                "athletes": num_athletes,
+                "nodes": graph_networkx.graph.number_of_nodes(),
+                "edges": graph_networkx.graph.number_of_edges(),
+                "seconds": seconds,
+            }
+        )
+    return results
+
+
+def benchmark_llm_chain(num_games: int, num_unknown: int = 1) -> dict:
+    # cold batch, warm batch from the cache, then abatch on an empty cache;
+    # games left out of the fake model come back as parsing errors
+    sports_events = generate_scoreboard(num_games + num_unknown)["events"]
+    graph_pydantic_manual = GraphPydanticManual()
+    recording_chat_model = RecordingChatModel(
+        [
+            graph_pydantic_manual.transform_graph_pydantic(sports_event)
+            for sports_event in sports_events[:num_games]
+        ]
+    )
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        graph_pydantic_chain = GraphPydanticChain(
+            PROMPT_PATH, llm=recording_chat_model, cache_dir=cache_dir
+        )
+        for run_name in ["cold", "warm"]:
+            # per-run numbers, the chain's counters are cumulative otherwise
+            recording_chat_model.reset()
+            graph_pydantic_chain.reset_stats()
+            output_graphs = graph_pydantic_chain.transform_graph_pydantic_batch(
+                sports_events
+            )
+            results[run_name] = {
+                "graphs": sum(graph is not None for graph in output_graphs),
+                "model_calls": recording_chat_model.num_calls,
+            } | dict(graph_pydantic_chain.stats)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        graph_pydantic_chain = GraphPydanticChain(
+            PROMPT_PATH, llm=recording_chat_model, cache_dir=cache_dir
+        )
+        recording_chat_model.reset()
+        output_graphs = asyncio.run(
+            graph_pydantic_chain.atransform_graph_pydantic_batch(sports_events)
+        )
+        results["async"] = {
+            "graphs": sum(graph is not None for graph in output_graphs),
+            "model_calls": recording_chat_model.num_calls,
+        } | dict(graph_pydantic_chain.stats)
+    return results
+
+
+def run_benchmarks(sizes: list[int], num_leaders: int = 3, repeat: int = 3) -> dict:
+    benchmark = {
+        "sizes": sizes,
+        "transform": benchmark_transform_sizes(sizes, num_leaders, repeat),
+        "build_graph": benchmark_build_graph_sizes(sizes, num_leaders, repeat),
+        "update_graph_from_df": benchmark_update_graph_from_df_sizes(sizes, repeat),
+        "detect_community": benchmark_detect_community_sizes(sizes),
+        "llm_chain": benchmark_llm_chain(min(sizes)),
+    }
+    for stage_name in ["transform", "build_graph", "update_graph_from_df"]:
+        for result in benchmark[stage_name]:
+            size = result.get("games", result.get("athletes"))
+            round_trips = result.get("round_trips", "-")
+            print(
+                f"{stage_name} {result['mode']} size={size}: ",
+                f"{result['seconds']:.4f}s, round trips {round_trips}",
+            )
+    for result in benchmark["detect_community"]:
+        print(
+            f"detect_community size={result['athletes']}: {result['seconds']:.4f}s",
+            f"({result['nodes']} nodes, {result['edges']} edges)",
+        )
+    for run_name, result in benchmark["llm_chain"].items():
+        print(
+            f"llm_chain {run_name}: {result['graphs']} graphs, "
+            f"{result['llm_calls']} llm calls, {result['cache_hits']} cache hits, "
+            f"{result['errors']} errors, {result['input_tokens']} input tokens"
+        )
+    return benchmark
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline ETL benchmarks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--leaders", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    benchmark = run_benchmarks(args.sizes, args.leaders, args.repeat)
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    run_time = datetime.now().strftime("%Y%m%dT%H%M%S")
+    report_path = os.path.join(REPORT_DIR, f"benchmark_{run_time}.json")
+    with open(report_path, "w") as report_file:
+        json.dump(benchmark, report_file, indent=2)
+    print(f"benchmark written to {report_path}")
@@ -0,0 +1,147 @@
+import numpy as np
+import networkx as nx
+from scipy import sparse
+from etl.graphs import GraphNeo4j, GraphNetworkx
+from etl.neo4j_to_networkx import EdgeSnapshot, neo4j_get_edges_agent_athlete
+
+
+class BipartiteAgentAthlete:
+    def __init__(
+        self, agents: list[str], athletes: list[str], incidence: sparse.csr_matrix
+    ):
+        # incidence[i, j] = 1 when agent i represents athlete j
+        self.agents = agents
+        self.athletes = athletes
+        self.incidence = incidence
+
+    def __str__(self):
+        return (
+            f"Bipartite graph with {len(self.agents)} agents, "
+            f"{len(self.athletes)} athletes and {self.incidence.nnz} edges"
+        )
+
+    @classmethod
+    def from_index_pairs(
+        cls, agent_index: np.ndarray, athlete_index: np.ndarray, agents, athletes
+    ) -> "BipartiteAgentAthlete":
+        incidence = sparse.csr_matrix(
+            (np.ones(len(agent_index), dtype=np.int32), (agent_index, athlete_index)),
+            shape=(len(agents), len(athletes)),
+        )
+        # duplicate edges are summed on construction, clamp back to 0/1
+        incidence.data[:] = 1
+        return cls(list(agents), list(athletes), incidence)
+
+    @classmethod
+    def from_edges(cls, edge_list: list[tuple[str, str]]) -> "BipartiteAgentAthlete":
+        edge_array = np.array(edge_list, dtype=object).reshape(-1, 2)
+        agents, agent_index = np.unique(edge_array[:, 0], return_inverse=True)
+        athletes, athlete_index = np.unique(edge_array[:, 1], return_inverse=True)
+        return cls.from_index_pairs(agent_index, athlete_index, agents, athletes)
+
+    @classmethod
+    def from_snapshot(cls, edge_snapshot: EdgeSnapshot) -> "BipartiteAgentAthlete":
+        # snapshot ids share one namespace, re-index each side densely
+        agent_ids, agent_index = np.unique(
+            edge_snapshot.edges[:, 0], return_inverse=True
+        )
+        athlete_ids, athlete_index = np.unique(
+            edge_snapshot.edges[:, 1], return_inverse=True
+        )
+        names = edge_snapshot.names.names
+        return cls.from_index_pairs(
+            agent_index,
+            athlete_index,
+            [names[agent_id] for agent_id in agent_ids],
+            [names[athlete_id] for athlete_id in athlete_ids],
+        )
+
+    def agent_degrees(self) -> np.ndarray:
+        return np.asarray(self.incidence.sum(axis=1)).ravel()
+
+    def athlete_degrees(self) -> np.ndarray:
+        return np.asarray(self.incidence.sum(axis=0)).ravel()
+
+    def get_degree_stats(self) -> dict:
+        degree_stats = {}
+        for side, degrees in [
+            ("agent", self.agent_degrees()),
+            ("athlete", self.athlete_degrees()),
+        ]:
+            degree_stats[side] = {
+                "count": len(degrees),
+                "mean": float(degrees.mean()) if len(degrees) else 0.0,
+                "max": int(degrees.max()) if len(degrees) else 0,
+                "histogram": np.bincount(degrees).tolist(),
+            }
+        return degree_stats
+
+    def project_agents(self) -> sparse.csr_matrix:
+        # [i, k] = number of athletes agent i and agent k both represent
+        projection = (self.incidence @ self.incidence.T).tocsr()
+        projection.setdiag(0)
+        projection.eliminate_zeros()
+        return projection
+
+    def project_athletes(self) -> sparse.csr_matrix:
+        # [j, l] = number of agents athlete j and athlete l have in common
+        projection = (self.incidence.T @ self.incidence).tocsr()
+        projection.setdiag(0)
+        projection.eliminate_zeros()
+        return projection
+
+    def get_side(self, side: str) -> tuple[list[str], np.ndarray, sparse.csr_matrix]:
+        if side == "agent":
+            return self.agents, self.agent_degrees(), self.project_agents()
+        if side == "athlete":
+            return self.athletes, self.athlete_degrees(), self.project_athletes()
+        raise ValueError(f"unknown bipartite side {side}")
+
+    def get_overlaps(self, side: str = "agent", top_n: int = 10) -> list[dict]:
+        names, degrees, projection = self.get_side(side)
+        upper = sparse.triu(projection, k=1).tocoo()
+        shared = upper.data
+        jaccard = shared / (degrees[upper.row] + degrees[upper.col] - shared)
+        top_index = np.argsort(-shared, kind="stable")[:top_n]
+        return [
+            {
+                "pair": (names[upper.row[i]], names[upper.col[i]]),
+                "shared": int(shared[i]),
+                "jaccard": float(jaccard[i]),
+            }
+            for i in top_index
+        ]
+
+    def to_networkx(self, graph_name: str = "agent_athlete") -> GraphNetworkx:
+        graph_networkx = GraphNetworkx(graph_name)
+        agent_index, athlete_index = self.incidence.nonzero()
+        graph_networkx.add_edges(
+            [
+                (self.agents[i], self.athletes[j])
+                for i, j in zip(agent_index, athlete_index)
+            ]
+        )
+        return graph_networkx
+
+    def projection_to_networkx(self, side: str = "agent") -> GraphNetworkx:
+        names, _, projection = self.get_side(side)
+        graph_projection = nx.from_scipy_sparse_array(projection)
+        graph_projection = nx.relabel_nodes(graph_projection, dict(enumerate(names)))
+        return GraphNetworkx(f"{side}_projection", graph_projection)
+
+
+def convert_agent_athlete_neo4j_bipartite(
+    graph_neo4j: GraphNeo4j,
+) -> BipartiteAgentAthlete:
+    agent_athlete_edge_list = neo4j_get_edges_agent_athlete(graph_neo4j)
+    graph_bipartite = BipartiteAgentAthlete.from_edges(agent_athlete_edge_list)
+    print(graph_bipartite)
+    return graph_bipartite
+
+
+if __name__ == "__main__":
+    with GraphNeo4j() as graph_neo4j:
+        graph_bipartite = convert_agent_athlete_neo4j_bipartite(graph_neo4j)
+    print(graph_bipartite.get_degree_stats())
+    for agent_overlap in graph_bipartite.get_overlaps("agent"):
+        print(agent_overlap)
@@ -0,0 +1,149 @@
+import os
+import json
+import networkx as nx
+
+
+def get_edge_set(graph: nx.Graph) -> set[tuple[str, str]]:
+    return {tuple(sorted(edge)) for edge in graph.edges()}
+
+
+class CommunityPartition:
+    def __init__(
+        self,
+        membership: dict[str, int] | None = None,
+        edges: set[tuple[str, str]] | None = None,
+    ):
+        # node -> community id, plus the edge set the partition was computed on
+        self.membership = {} if membership is None else membership
+        self.edges = set() if edges is None else edges
+
+    def __str__(self):
+        num_nodes = len(self.membership)
+        num_communities = len(set(self.membership.values()))
+        return f"Partition of {num_nodes} nodes into {num_communities} communities"
+
+    def save(self, partition_path: str) -> None:
+        os.makedirs(os.path.dirname(partition_path), exist_ok=True)
+        with open(partition_path, "w") as partition_file:
+            json.dump(
+                {"membership": self.membership, "edges": sorted(self.edges)},
+                partition_file,
+            )
+
+    @classmethod
+    def load(cls, partition_path: str) -> "CommunityPartition":
+        with open(partition_path, "r") as partition_file:
+            partition_data = json.load(partition_file)
+        return cls(
+            partition_data["membership"],
+            {tuple(edge) for edge in partition_data["edges"]},
+        )
+
+    @classmethod
+    def from_communities(
+        cls, communities: list[set], edges: set[tuple[str, str]]
+    ) -> "CommunityPartition":
+        membership = {
+            node: community_id
+            for community_id, community_member in enumerate(communities)
+            for node in community_member
+        }
+        return cls(membership, edges)
+
+    def to_communities(self) -> list[set]:
+        communities = {}
+        for node, community_id in self.membership.items():
+            communities.setdefault(community_id, set()).add(node)
+        return [communities[community_id] for community_id in sorted(communities)]
+
+
+def match_community_ids(
+    new_communities: list[set], previous: CommunityPartition, next_id: int
+) -> dict[str, int]:
+    # recomputed communities inherit the old id they overlap most with
+    membership = {}
+    used_ids = set()
+    for community_member in sorted(new_communities, key=len, reverse=True):
+        overlap = {}
+        for node in community_member:
+            community_id = previous.membership.get(node)
+            if community_id is not None and community_id not in used_ids:
+                overlap[community_id] = overlap.get(community_id, 0) + 1
+        if overlap:
+            community_id = max(overlap, key=lambda old_id: (overlap[old_id], -old_id))
+        else:
+            community_id = next_id
+            next_id += 1
+        used_ids.add(community_id)
+        for node in community_member:
+            membership[node] = community_id
+    return membership
+
+
+def update_partition(
+    graph: nx.Graph, previous: CommunityPartition | None = None, seed=None
+) -> tuple[CommunityPartition, dict]:
+    edges = get_edge_set(graph)
+    if previous is None or not previous.membership:
+        communities = nx.community.louvain_communities(graph, seed=seed)
+        partition = CommunityPartition.from_communities(communities, edges)
+        partition_report = {
+            "full_recompute": True,
+            "added_edges": len(edges),
+            "removed_edges": 0,
+            "recomputed_nodes": graph.number_of_nodes(),
+            "changed_nodes": graph.number_of_nodes(),
+        }
+        return partition, partition_report
+
+    added_edges = edges - previous.edges
+    removed_edges = previous.edges - edges
+    touched_nodes = {node for edge in added_edges | removed_edges for node in edge}
+    touched_nodes |= {node for node in graph if node not in previous.membership}
+    touched_ids = {
+        previous.membership[node]
+        for node in touched_nodes
+        if node in previous.membership
+    }
+    # every member of a touched community is re-clustered, the rest is kept
+    recompute_nodes = {
+        node
+        for node in graph
+        if node in touched_nodes or previous.membership.get(node) in touched_ids
+    }
+    membership = {
+        node: previous.membership[node] for node in graph if node not in recompute_nodes
+    }
+    if recompute_nodes:
+        communities = nx.community.louvain_communities(
+            graph.subgraph(recompute_nodes), seed=seed
+        )
+        next_id = max(previous.membership.values(), default=-1) + 1
+        membership.update(match_community_ids(communities, previous, next_id))
+
+    partition = CommunityPartition(membership, edges)
+    changed_nodes = sum(
+        1
+        for node, community_id in membership.items()
+        if previous.membership.get(node) != community_id
+    )
+    partition_report = {
+        "full_recompute": False,
+        "added_edges": len(added_edges),
+        "removed_edges": len(removed_edges),
+        "recomputed_nodes": len(recompute_nodes),
+        "changed_nodes": changed_nodes,
+    }
+    return partition, partition_report
+
+
+def update_partition_file(
+    graph: nx.Graph, partition_path: str, full_recompute: bool = False, seed=None
+) -> list[set]:
+    previous = None
+    if not full_recompute and os.path.exists(partition_path):
+        previous = CommunityPartition.load(partition_path)
+    partition, partition_report = update_partition(graph, previous, seed)
+    partition.save(partition_path)
+    print(partition, partition_report)
+    return partition.to_communities()
@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import hashlib
+import networkx as nx
+import pygraphviz as pgv
+from concurrent.futures import Future, ProcessPoolExecutor
+from etl.graphs import GraphNetworkx
+
+RENDER_MANIFEST_FILE = "render_manifest.json"
+
+
+def hash_graph_networkx(graph: nx.Graph) -> str:
+    # node and edge order from the source graph must not change the hash
+    graph_content = {
+        "nodes": sorted(str(node) for node in graph.nodes()),
+        "edges": sorted(
+            sorted([str(node_from), str(node_to)])
+            for node_from, node_to in graph.edges()
+        ),
+    }
+    return hashlib.sha256(json.dumps(graph_content).encode("utf-8")).hexdigest()
+
+
+def get_layout(
+    num_nodes: int, large_graph_nodes: int = 200, layout_max_iter: int = 300
+) -> tuple[str, str]:
+    # fdp looks better but is quadratic, sfdp keeps large subgraphs bounded
+    if num_nodes <= large_graph_nodes:
+        return "fdp", f"-Gmaxiter={layout_max_iter}"
+    return "sfdp", f"-Goverlap=scale -Gmaxiter={layout_max_iter}"
+
+
+def render_dot(dot_source: str, output_path: str, prog: str, layout_args: str) -> float:
+    render_start = time.perf_counter()
+    agraph = pgv.AGraph(string=dot_source)
+    agraph.draw(output_path, prog=prog, args=layout_args)
+    return time.perf_counter() - render_start
+
+
+class GraphRenderer:
+    def __init__(
+        self,
+        output_dir: str,
+        max_workers: int = 4,
+        large_graph_nodes: int = 200,
+        layout_max_iter: int = 300,
+    ):
+        self.output_dir = output_dir
+        # workers write straight into it, so it has to exist before any submit
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.large_graph_nodes = large_graph_nodes
+        self.layout_max_iter = layout_max_iter
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        self.manifest_path = os.path.join(output_dir, RENDER_MANIFEST_FILE)
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r") as manifest_file:
+                self.manifest = json.load(manifest_file)
+        self.pending: dict[str, tuple[str, Future]] = {}
+        self.stats = {"submitted": 0, "skipped": 0, "failed": 0, "render_time": 0.0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_output_path(self, graph_name: str) -> str:
+        return os.path.join(self.output_dir, f"{graph_name}.png")
+
+    def submit(self, graph_networkx: GraphNetworkx) -> Future | None:
+        graph_hash = hash_graph_networkx(graph_networkx.graph)
+        output_path = self.get_output_path(graph_networkx.name)
+        if self.manifest.get(graph_networkx.name) == graph_hash and os.path.exists(
+            output_path
+        ):
+            self.stats["skipped"] += 1
+            return None
+        prog, layout_args = get_layout(
+            graph_networkx.graph.number_of_nodes(),
+            self.large_graph_nodes,
+            self.layout_max_iter,
+        )
+        # the dot text is built here, only plain strings cross the process pool
+        dot_source = nx.nx_agraph.to_agraph(graph_networkx.graph).to_string()
+        render_future = self.executor.submit(
+            render_dot, dot_source, output_path, prog, layout_args
+        )
+        self.pending[graph_networkx.name] = (graph_hash, render_future)
+        self.stats["submitted"] += 1
+        return render_future
+
+    def wait(self) -> dict:
+        for graph_name, (graph_hash, render_future) in self.pending.items():
+            try:
+                self.stats["render_time"] += render_future.result()
+                self.manifest[graph_name] = graph_hash
+            except Exception as e:
+                self.stats["failed"] += 1
+                print(f"Failed to render {graph_name}: {e}")
+        self.pending = {}
+        with open(self.manifest_path, "w") as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=2)
+        return self.stats
+
+    def close(self) -> None:
+        self.wait()
+        self.executor.shutdown()
@@ -0,0 +1,163 @@
+import os
+import sys
+import glob
+import json
+import time
+import tempfile
+from collections.abc import Iterable, Iterator
+from etl.models import GraphSports
+
+GRAPH_STORE_FILE = "graphs.jsonl"
+GRAPH_INDEX_FILE = "graphs.index.json"
+
+
+class GraphSportsStore:
+    def __init__(self, store_dir: str):
+        # one JSON line per game, plus game id -> (offset, length) in a side index
+        self.store_dir = store_dir
+        self.data_path = os.path.join(store_dir, GRAPH_STORE_FILE)
+        self.index_path = os.path.join(store_dir, GRAPH_INDEX_FILE)
+        self.index = self.read_index()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, game_id: int | str):
+        return str(game_id) in self.index
+
+    def read_index(self) -> dict[str, list[int]]:
+        if not os.path.exists(self.data_path):
+            return {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as index_file:
+                graph_index = json.load(index_file)
+            # entries appended after the last index write are picked up below
+            indexed_end = max((sum(entry) for entry in graph_index.values()), default=0)
+            if indexed_end == os.path.getsize(self.data_path):
+                return graph_index
+        return self.rebuild_index()
+
+    def rebuild_index(self) -> dict[str, list[int]]:
+        graph_index = {}
+        with open(self.data_path, "rb") as data_file:
+            offset = 0
+            for graph_line in data_file:
+                game_id = json.loads(graph_line)["game"]["id"]
+                graph_index[str(game_id)] = [offset, len(graph_line)]
+                offset += len(graph_line)
+        return graph_index
+
+    def write_index(self) -> None:
+        with open(f"{self.index_path}.tmp", "w") as index_file:
+            json.dump(self.index, index_file)
+        os.replace(f"{self.index_path}.tmp", self.index_path)
+
+    def read_line(self, game_id: int | str) -> bytes | None:
+        if str(game_id) not in self.index:
+            return None
+        offset, length = self.index[str(game_id)]
+        with open(self.data_path, "rb") as data_file:
+            data_file.seek(offset)
+            return data_file.read(length)
+
+    def append(self, graphs_pydantic_sports: Iterable[GraphSports]) -> int:
+        # append-only, a changed game written again supersedes its earlier line,
+        # an unchanged one is skipped so reruns of a day do not grow the file
+        os.makedirs(self.store_dir, exist_ok=True)
+        num_graphs = 0
+        with open(self.data_path, "ab") as data_file:
+            for graph_pydantic_sports in graphs_pydantic_sports:
+                graph_line = graph_pydantic_sports.model_dump_json().encode() + b"\n"
+                game_id = graph_pydantic_sports.game.id
+                if self.read_line(game_id) == graph_line:
+                    continue
+                offset = data_file.tell()
+                data_file.write(graph_line)
+                self.index[str(game_id)] = [offset, len(graph_line)]
+                num_graphs += 1
+        self.write_index()
+        if os.path.getsize(self.data_path) > 2 * self.get_live_size():
+            self.compact()
+        return num_graphs
+
+    def get_live_size(self) -> int:
+        return sum(length for _, length in self.index.values())
+
+    def compact(self) -> int:
+        # rewrite only the latest line per game, dropping superseded ones
+        compact_index = {}
+        with open(self.data_path, "rb") as data_file, open(
+            f"{self.data_path}.tmp", "wb"
+        ) as compact_file:
+            for game_id, (offset, length) in sorted(
+                self.index.items(), key=lambda entry: entry[1][0]
+            ):
+                data_file.seek(offset)
+                compact_index[game_id] = [compact_file.tell(), length]
+                compact_file.write(data_file.read(length))
+        os.replace(f"{self.data_path}.tmp", self.data_path)
+        self.index = compact_index
+        self.write_index()
+        return len(compact_index)
+
+    def read_game(self, game_id: int | str) -> GraphSports:
+        offset, length = self.index[str(game_id)]
+        with open(self.data_path, "rb") as data_file:
+            data_file.seek(offset)
+            return GraphSports.model_validate_json(data_file.read(length))
+
+    def iterate_graphs(self) -> Iterator[GraphSports]:
+        # latest line per game, in file order
+        with open(self.data_path, "rb") as data_file:
+            for offset, length in sorted(self.index.values()):
+                data_file.seek(offset)
+                yield GraphSports.model_validate_json(data_file.read(length))
+
+
+def read_graphs_json(process_dir: str) -> list[GraphSports]:
+    graphs_pydantic_sports = []
+    for file_path in glob.glob(f"{process_dir}/*.json"):
+        if os.path.basename(file_path).split(".")[0] in ["raw_events", "graphs"]:
+            continue
+        with open(file_path, "r") as input_file:
+            input_data = json.load(input_file)
+        graphs_pydantic_sports.append(GraphSports.model_validate(input_data))
+    return graphs_pydantic_sports
+
+
+def benchmark_graph_store(process_dir: str) -> dict:
+    json_files = [
+        file_path
+        for file_path in glob.glob(f"{process_dir}/*.json")
+        if os.path.basename(file_path).split(".")[0] not in ["raw_events", "graphs"]
+    ]
+    json_bytes = sum(os.path.getsize(file_path) for file_path in json_files)
+    time_start = time.perf_counter()
+    graphs_pydantic_sports = read_graphs_json(process_dir)
+    json_seconds = time.perf_counter() - time_start
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        graph_store = GraphSportsStore(store_dir)
+        graph_store.append(graphs_pydantic_sports)
+        store_bytes = os.path.getsize(graph_store.data_path) + os.path.getsize(
+            graph_store.index_path
+        )
+        time_start = time.perf_counter()
+        num_graphs = len(list(GraphSportsStore(store_dir).iterate_graphs()))
+        store_seconds = time.perf_counter() - time_start
+
+    benchmark = {
+        "games": num_graphs,
+        "json": {"bytes": json_bytes, "seconds": json_seconds},
+        "jsonl": {"bytes": store_bytes, "seconds": store_seconds},
+    }
+    print(
+        f"{num_graphs} games: ",
+        f"json {json_bytes} bytes loaded in {json_seconds:.4f}s, ",
+        f"jsonl {store_bytes} bytes loaded in {store_seconds:.4f}s",
+    )
+    return benchmark
+
+
+if __name__ == "__main__":
+    benchmark_graph_store(sys.argv[1])
@@ -1,8 +1,18 @@
 import os
+import time
+import atexit
+import threading
 import networkx as nx
 import pygraphviz as pgv
+from collections import defaultdict
+from collections.abc import Iterator
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
-from neo4j import GraphDatabase, Driver
+from neo4j import GraphDatabase, Driver, EagerResult, ManagedTransaction, Session
+from neo4j.exceptions import ClientError
+from etl.instrumentation import PROFILE, get_summary_counters
+from etl.athlete_index import AthleteNameIndex
+from etl.team_history import TeamHistoryIndex, TeamHistoryPlan
 from etl.models import (
     GraphSports,
     AthleteCompeteIn,
@@ -12,18 +22,427 @@ from etl.models import (
     Edge,
 )
 
+if TYPE_CHECKING:
+    from graphdatascience import GraphDataScience
+
 load_dotenv()
 
+# idempotent, safe to run at the start of every load
+SCHEMA_QUERIES = [
+    "CREATE CONSTRAINT athlete_id IF NOT EXISTS FOR (n:athlete) REQUIRE n.id IS UNIQUE",
+    "CREATE CONSTRAINT team_id IF NOT EXISTS FOR (n:team) REQUIRE n.id IS UNIQUE",
+    "CREATE CONSTRAINT game_id IF NOT EXISTS FOR (n:game) REQUIRE n.id IS UNIQUE",
+    "CREATE INDEX athlete_name IF NOT EXISTS FOR (n:athlete) ON (n.name)",
+    "CREATE INDEX team_name IF NOT EXISTS FOR (n:team) ON (n.name)",
+    "CREATE INDEX agent_name IF NOT EXISTS FOR (n:agent) ON (n.name)",
+    "CREATE INDEX represent_created_at IF NOT EXISTS FOR ()-[r:represent]-() ON (r.created_at)",
+    "CREATE INDEX athlete_last_updated IF NOT EXISTS FOR (n:athlete) ON (n.last_updated)",
+    "CREATE INDEX team_last_updated IF NOT EXISTS FOR (n:team) ON (n.last_updated)",
+    "CREATE INDEX game_last_updated IF NOT EXISTS FOR (n:game) ON (n.last_updated)",
+    "CREATE INDEX athlete_rollup_date IF NOT EXISTS FOR (n:athlete_rollup) ON (n.date)",
+    "CREATE CONSTRAINT etl_checkpoint_name IF NOT EXISTS FOR (n:etl_checkpoint) REQUIRE n.name IS UNIQUE",
+]
+
+# graphs built before the id constraints can hold several nodes per id (the old
+# MERGE matched on id, name and name_short together); they are merged before
+# the constraint is created, keeping the most recently updated node's properties
+ID_CONSTRAINT_LABELS = ["athlete", "team", "game"]
+SHOW_CONSTRAINT_NAMES_QUERY = (
+    "SHOW CONSTRAINTS YIELD name RETURN collect(name) AS names"
+)
+DEDUPE_NODES_BY_ID_QUERY = """
+MATCH (n:{label})
+WHERE n.id IS NOT NULL
+WITH n ORDER BY coalesce(n.last_updated, 0) DESC
+WITH n.id AS id, collect(n) AS nodes
+WHERE size(nodes) > 1
+CALL apoc.refactor.mergeNodes(nodes, {{properties: "discard", mergeRels: true}})
+YIELD node
+RETURN count(node) AS num_merged
+"""
+
+# one fixed statement per node label, keyed on the unique id
+NODE_BATCH_QUERIES = {
+    node_label: (
+        "UNWIND $rows AS row\n"
+        f"MERGE (n:{node_label} {{id: row.id}})\n"
+        "SET n += row, n.last_updated = timestamp()"
+    )
+    for node_label in ["game", "athlete", "team"]
+}
+
+# duplicate candidates, grouped on the indexed name of recently touched nodes
+TOUCHED_NODES_CLAUSE = {
+    True: "MATCH (n:{label})\nWHERE n.last_updated >= $since\n",
+    False: "MATCH (n:{label})\n",
+}
+FIND_DUPLICATE_ATHLETES_QUERY = (
+    "WITH DISTINCT n.name AS name\n"
+    "MATCH (a1:athlete {name: name})\n"
+    "WHERE a1.id IS NULL\n"
+    "MATCH (a2:athlete {name: name})\n"
+    "WHERE a2.id IS NOT NULL\n"
+    "WITH a1, collect(a2) AS matches\n"
+    "RETURN elementId(a1) AS merge_id, [m IN matches | elementId(m)] AS keep_ids"
+)
+FIND_DUPLICATE_TEAMS_QUERY = (
+    "WITH DISTINCT n.name AS name\n"
+    "MATCH (t1:team {name: name})\n"
+    "MATCH (t2:team {name: name})\n"
+    "WHERE upper(t2.name_short) = t2.name_short\n"
+    "AND t1.name_short <> t2.name_short\n"
+    "RETURN elementId(t1) AS keep_id, elementId(t2) AS merge_id"
+)
+# the node carrying the id is kept, so the id constraint never sees two copies
+MERGE_ATHLETES_QUERY = """
+UNWIND $pairs AS pair
+MATCH (a1:athlete) WHERE elementId(a1) = pair.merge_id
+MATCH (a2:athlete) WHERE elementId(a2) = pair.keep_id
+CALL apoc.refactor.mergeNodes([a2, a1]) YIELD node
+RETURN count(node) AS num_merged
+"""
+MERGE_TEAMS_QUERY = """
+UNWIND $pairs AS pair
+MATCH (t1:team) WHERE elementId(t1) = pair.keep_id
+MATCH (t2:team) WHERE elementId(t2) = pair.merge_id
+OPTIONAL MATCH (t2)<-[c2:compete_for]-(:athlete)-[c1:compete_for]->(t1)
+SET c2.first_date = c1.first_date, c2.last_date = c1.last_date
+WITH DISTINCT t1, t2
+CALL apoc.refactor.mergeNodes([t1, t2]) YIELD node
+RETURN count(node) AS num_merged
+"""
+
+# every game of an athlete on a day that had a game loaded, to rebuild that day
+FIND_ROLLUP_ATHLETE_DAYS_QUERY = (
+    "MATCH (a:athlete)-[:compete_in]->(n)\n"
+    "WITH DISTINCT a, substring(n.date, 0, 10) AS date\n"
+    "MATCH (a)-[c:compete_in]->(g:game)\n"
+    "WHERE substring(g.date, 0, 10) = date\n"
+    "RETURN a.id AS athlete_id, date, collect(properties(c)) AS stats"
+)
+# a rollup is identified by its athlete and date, older copies are replaced
+UPSERT_ATHLETE_ROLLUPS_QUERY = """
+UNWIND $rows AS row
+MATCH (a:athlete {id: row.athlete_id})
+OPTIONAL MATCH (a)-[:has_rollup]->(old:athlete_rollup {date: row.date})
+DETACH DELETE old
+WITH DISTINCT a, row
+CREATE (a)-[:has_rollup]->(r:athlete_rollup {date: row.date})
+SET r += row.totals, r.last_updated = timestamp()
+"""
+
+# latest compete_for edge per athlete, the team it currently plays for
+CURRENT_TEAMS_QUERY = """
+MATCH (a:athlete)-[e:compete_for]->(t:team)
+WHERE a.id IS NOT NULL
+WITH a, t, coalesce(e.last_date, e.first_date) AS last_date
+ORDER BY last_date DESC
+WITH a, collect({team_id: t.id, last_date: last_date})[0] AS current
+RETURN a.id AS athlete_id, current.team_id AS team_id, current.last_date AS last_date
+"""
+# the previous team's name is copied onto the edge, so the API can show it
+UPSERT_TEAM_CHANGES_QUERY = """
+UNWIND $rows AS row
+MATCH (a:athlete {id: row.athlete_id})
+MATCH (t:team {id: row.to_team_id})
+OPTIONAL MATCH (f:team {id: row.from_team_id})
+MERGE (a)-[c:changed_team {date: row.date}]->(t)
+SET c.from_team_id = row.from_team_id, c.from_team_name = f.name
+"""
+# compete_for edges per athlete in first_date order, for the changed_team backfill
+FIND_TEAM_STINTS_QUERY = """
+MATCH (a:athlete)-[e:compete_for]->(t:team)
+WHERE a.id IS NOT NULL AND e.first_date IS NOT NULL
+WITH a, t, e.first_date AS first_date
+ORDER BY first_date
+WITH a, collect({team_id: t.id, first_date: first_date}) AS stints
+WHERE size(stints) > 1
+RETURN a.id AS athlete_id, stints
+"""
+
+# agent table upserts: a name matching several athletes is left alone and reported
+UPSERT_ATHLETES_QUERY = """
+UNWIND $names AS name
+OPTIONAL MATCH (a:athlete {name: name})
+WITH name, count(a) AS num_match
+FOREACH (_ IN CASE WHEN num_match = 0 THEN [1] ELSE [] END |
+    MERGE (n:athlete {name: name})
+    SET n.last_updated = timestamp()
+)
+WITH name, num_match
+WHERE num_match > 1
+RETURN name, num_match
+"""
+ATHLETE_NAME_COUNTS_QUERY = """
+MATCH (a:athlete)
+WHERE a.name IS NOT NULL
+RETURN a.name AS name, count(a) AS num_match
+"""
+UPSERT_AGENTS_QUERY = """
+UNWIND $names AS name
+MERGE (n:agent {name: name})
+"""
+UPSERT_EDGES_AGENT_ATHLETE_QUERY = """
+UNWIND $rows AS row
+MATCH (t:athlete {name: row.athlete_name})
+MATCH (g:agent)
+WHERE g.name IN row.agent_names
+MERGE (t)<-[r:represent]-(g)
+ON CREATE SET r.created_at = timestamp()
+"""
+GDS_PROJECT_AGENT_ATHLETE_QUERY = """
+MATCH (source:agent)-[:represent]->(target:athlete)
+WITH gds.graph.project(
+    $graph_name, source, target, {}, {undirectedRelationshipTypes: ['*']}
+) AS projection
+RETURN projection.nodeCount AS node_count, projection.relationshipCount AS edge_count
+"""
+GDS_LOUVAIN_STREAM_QUERY = """
+CALL gds.louvain.stream($graph_name) YIELD nodeId, communityId
+RETURN gds.util.asNode(nodeId).name AS name, communityId AS community_id
+"""
+GDS_DROP_GRAPH_QUERY = """
+CALL gds.graph.drop($graph_name, false) YIELD graphName
+RETURN graphName
+"""
+
+
+def chunk_list(items: list, chunk_size: int) -> list[list]:
+    return [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+def generate_node_row(node_pydantic: Node) -> tuple[str, dict]:
+    node_attributes = node_pydantic.model_dump()
+    node_label = node_attributes.pop("label")
+    return node_label, node_attributes
+
+
+def generate_edge_row(edge_pydantic: Edge) -> dict:
+    edge_attributes = edge_pydantic.model_dump(exclude={"relation_type"})
+    if isinstance(edge_pydantic, AthleteCompeteIn):
+        edge_attributes["stats"] = {
+            athlete_stats.stats_name: athlete_stats.stats_value
+            for athlete_stats in edge_pydantic.stats
+        }
+    return edge_attributes
+
+
+def group_nodes_pydantic(graphs_pydantic_sports: list[GraphSports]) -> dict:
+    # label -> rows, de-duplicated on id across games
+    node_rows = defaultdict(dict)
+    for graph_pydantic_sports in graphs_pydantic_sports:
+        graph_nodes = [
+            graph_pydantic_sports.game,
+            *graph_pydantic_sports.athletes,
+            *graph_pydantic_sports.teams,
+        ]
+        for node_pydantic in graph_nodes:
+            node_label, node_attributes = generate_node_row(node_pydantic)
+            node_rows[node_label][node_attributes["id"]] = node_attributes
+    return {label: list(rows.values()) for label, rows in node_rows.items()}
+
+
+def group_edges_pydantic(graphs_pydantic_sports: list[GraphSports]) -> dict:
+    # edge type -> rows
+    edge_rows = defaultdict(list)
+    for graph_pydantic_sports in graphs_pydantic_sports:
+        graph_edges = [
+            *graph_pydantic_sports.athlete_compete_in_game,
+            *graph_pydantic_sports.athlete_compete_for_team,
+            *graph_pydantic_sports.team_compete_in_game,
+        ]
+        for edge_pydantic in graph_edges:
+            edge_rows[type(edge_pydantic)].append(generate_edge_row(edge_pydantic))
+    return edge_rows
+
+
+# one fixed statement per edge type, each writing a whole group of rows
+EDGE_BATCH_QUERIES = {
+    AthleteCompeteIn: (
+        "UNWIND $rows AS row\n"
+        "MATCH (a:athlete {id: row.from_node_id})\n"
+        "MATCH (g:game {id: row.to_node_id})\n"
+        "MERGE (a)-[e:compete_in]->(g)\n"
+        "SET e += row.stats"
+    ),
+    AthleteCompeteFor: (
+        "UNWIND $rows AS row\n"
+        "MATCH (a:athlete {id: row.from_node_id})\n"
+        "MATCH (t:team {id: row.to_node_id})\n"
+        "MERGE (a)-[e:compete_for]->(t)\n"
+        "ON CREATE SET e.jersey = row.jersey, e.first_date = row.date\n"
+        "ON MATCH SET e.last_date = row.date"
+    ),
+    TeamCompeteIn: (
+        "UNWIND $rows AS row\n"
+        "MATCH (t:team {id: row.from_node_id})\n"
+        "MATCH (g:game {id: row.to_node_id})\n"
+        "MERGE (t)-[e:compete_in]->(g)\n"
+        "SET e.home_or_away = row.home_or_away, e.is_winner = row.is_winner"
+    ),
+}
+
 
 class GraphNeo4j:
-    def __init__(self):
+    # one pooled driver per database, user and pool config, shared by the whole
+    # process and closed when the last instance using it closes
+    _drivers: dict[tuple, Driver] = {}
+    _driver_refs: dict[tuple, int] = {}
+    _drivers_lock = threading.Lock()
+    _schema_ready: set[tuple] = set()
+
+    def __init__(
+        self,
+        max_connection_pool_size: int = 50,
+        connection_acquisition_timeout: float = 60.0,
+        fetch_size: int = 1000,
+        neo4j_driver: Driver | None = None,
+    ):
+        # an injected driver (e.g. a recording stand-in) bypasses the shared pool
+        self.neo4j_driver = neo4j_driver
+        self.driver_acquired = False
+        self.athlete_index: AthleteNameIndex | None = None
+        self.team_history: TeamHistoryIndex | None = None
         self.neo4j_uri = os.getenv("NEO4J_URL")
         self.neo4j_auth = (os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD"))
-        with self.get_db_driver() as driver:
-            driver.verify_connectivity()
+        self.driver_config = {
+            "max_connection_pool_size": max_connection_pool_size,
+            "connection_acquisition_timeout": connection_acquisition_timeout,
+            "fetch_size": fetch_size,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_driver_key(self) -> tuple:
+        if self.neo4j_driver is not None:
+            return ("injected", id(self.neo4j_driver))
+        return (
+            self.neo4j_uri,
+            self.neo4j_auth[0],
+            *sorted(self.driver_config.items()),
+        )
 
     def get_db_driver(self) -> Driver:
-        return GraphDatabase.driver(uri=self.neo4j_uri, auth=self.neo4j_auth)
+        # created on first use, then reused; callers must not close it, and must
+        # not keep it past this instance's close()
+        if self.neo4j_driver is not None:
+            return self.neo4j_driver
+        driver_key = self.get_driver_key()
+        with GraphNeo4j._drivers_lock:
+            driver = GraphNeo4j._drivers.get(driver_key)
+            if driver is None:
+                driver = GraphDatabase.driver(
+                    uri=self.neo4j_uri, auth=self.neo4j_auth, **self.driver_config
+                )
+                driver.verify_connectivity()
+                GraphNeo4j._drivers[driver_key] = driver
+            if not self.driver_acquired:
+                GraphNeo4j._driver_refs[driver_key] = (
+                    GraphNeo4j._driver_refs.get(driver_key, 0) + 1
+                )
+                self.driver_acquired = True
+        return driver
+
+    def get_db_session(self) -> Session:
+        return self.get_db_driver().session(
+            database="neo4j", fetch_size=self.driver_config["fetch_size"]
+        )
+
+    def close(self) -> None:
+        # releases this instance's reference, the last one closes the driver
+        if not self.driver_acquired:
+            return
+        driver_key = self.get_driver_key()
+        driver = None
+        with GraphNeo4j._drivers_lock:
+            self.driver_acquired = False
+            num_refs = GraphNeo4j._driver_refs.get(driver_key, 1) - 1
+            if num_refs > 0:
+                GraphNeo4j._driver_refs[driver_key] = num_refs
+            else:
+                GraphNeo4j._driver_refs.pop(driver_key, None)
+                driver = GraphNeo4j._drivers.pop(driver_key, None)
+        if driver is not None:
+            driver.close()
+
+    def bootstrap_schema(self, neo4j_driver: Driver) -> None:
+        driver_key = self.get_driver_key()
+        if driver_key in GraphNeo4j._schema_ready:
+            return
+        self.dedupe_nodes_by_id(neo4j_driver)
+        for schema_query in SCHEMA_QUERIES:
+            try:
+                self.execute_query(neo4j_driver, query_=schema_query, database_="neo4j")
+            except ClientError as schema_error:
+                # e.g. duplicate ids left over from before the constraints existed
+                print(f"Schema not applied: {schema_query}\n{schema_error.message}")
+                raise
+        GraphNeo4j._schema_ready.add(driver_key)
+
+    def dedupe_nodes_by_id(self, neo4j_driver: Driver) -> int:
+        # only labels still missing their id constraint can hold duplicates
+        constraint_result = self.execute_query(
+            neo4j_driver, query_=SHOW_CONSTRAINT_NAMES_QUERY, database_="neo4j"
+        )
+        constraint_names = constraint_result.records[0]["names"]
+        num_merged = 0
+        for node_label in ID_CONSTRAINT_LABELS:
+            if f"{node_label}_id" in constraint_names:
+                continue
+            dedupe_result = self.execute_query(
+                neo4j_driver,
+                query_=DEDUPE_NODES_BY_ID_QUERY.format(label=node_label),
+                database_="neo4j",
+            )
+            num_label_merged = dedupe_result.records[0]["num_merged"]
+            if num_label_merged > 0:
+                print(f"{num_label_merged} {node_label} ids had duplicate nodes")
+            num_merged += num_label_merged
+        return num_merged
+
+    @classmethod
+    def close_all(cls) -> None:
+        with cls._drivers_lock:
+            drivers = list(cls._drivers.values())
+            cls._drivers.clear()
+            cls._driver_refs.clear()
+        for driver in drivers:
+            driver.close()
+
+    def execute_query(
+        self,
+        neo4j_driver: Driver,
+        query_: str,
+        parameters_: dict | None = None,
+        database_: str = "neo4j",
+    ) -> EagerResult:
+        # every driver round trip goes through here and into the run profile
+        query_start = time.perf_counter()
+        query_result = neo4j_driver.execute_query(
+            query_=query_, parameters_=parameters_, database_=database_
+        )
+        PROFILE.record_query(
+            query_,
+            time.perf_counter() - query_start,
+            len(query_result.records),
+            get_summary_counters(query_result.summary),
+        )
+        return query_result
+
+    def run_query(self, neo4j_tx: ManagedTransaction, query: str, **parameters):
+        query_start = time.perf_counter()
+        result_summary = neo4j_tx.run(query, **parameters).consume()
+        PROFILE.record_query(
+            query,
+            time.perf_counter() - query_start,
+            0,
+            get_summary_counters(result_summary),
+        )
+        return result_summary
 
     def generate_query_params(self, entity_attributes: dict) -> str:
         node_params = [
@@ -31,14 +450,37 @@ class GraphNeo4j:
         ]
         return "{" + ", ".join(node_params) + "}"
 
+    def load_athlete_index(self, max_names: int = 200_000) -> AthleteNameIndex:
+        # one streaming aggregate, pulled in fetch_size pages
+        athlete_index = AthleteNameIndex(max_names)
+        with self.get_db_session() as session:
+            name_counts = session.run(ATHLETE_NAME_COUNTS_QUERY)
+            athlete_index.load(
+                (name_count["name"], name_count["num_match"])
+                for name_count in name_counts
+            )
+        self.athlete_index = athlete_index
+        print(athlete_index)
+        return athlete_index
+
     def match_node_athlete(self, full_name: str, neo4j_driver: Driver) -> bool:
+        num_match = None
+        if self.athlete_index is not None:
+            num_match = self.athlete_index.lookup(full_name)
+        if num_match is not None:
+            if num_match > 1:
+                print(f"{num_match} matches found: {full_name}")
+            return num_match == 1
         match_query = f"MATCH (a:athlete)\nWHERE a.name = $athlete_name\nRETURN a"
-        match_result = neo4j_driver.execute_query(
+        match_result = self.execute_query(
+            neo4j_driver,
             query_=match_query,
             parameters_={"athlete_name": full_name},
             database_="neo4j",
         )
         num_match = len(match_result.records)
+        if self.athlete_index is not None:
+            self.athlete_index.set_count(full_name, num_match)
         if num_match == 0:
             return False
         elif num_match == 1:
@@ -48,77 +490,250 @@ class GraphNeo4j:
             return False
 
     def add_node_generic(self, node_pydantic: Node, neo4j_driver: Driver):
-        node_attributes = node_pydantic.model_dump()
-        node_label = node_attributes.pop("label")
-        node_property = self.generate_query_params(node_attributes)
-        node_query = f"MERGE (n:{node_label} {node_property})"
-        neo4j_driver.execute_query(
-            query_=node_query,
-            parameters_=node_attributes,
+        node_label, node_attributes = generate_node_row(node_pydantic)
+        self.execute_query(
+            neo4j_driver,
+            query_=NODE_BATCH_QUERIES[node_label],
+            parameters_={"rows": [node_attributes]},
             database_="neo4j",
         )
 
     def add_node_athlete(self, full_name: str, neo4j_driver: Driver) -> None:
         athlete_property = "{name: $athlete_name}"
-        add_query = f"MERGE (n:athlete {athlete_property})"
-        neo4j_driver.execute_query(
+        add_query = (
+            f"MERGE (n:athlete {athlete_property})\nSET n.last_updated = timestamp()"
+        )
+        self.execute_query(
+            neo4j_driver,
             query_=add_query,
             parameters_={"athlete_name": full_name},
             database_="neo4j",
         )
+        if self.athlete_index is not None:
+            self.athlete_index.add_merged(full_name)
 
     def add_node_agent(self, full_name: str, neo4j_driver: Driver) -> None:
         agent_property = "{name: $agent_name}"
         add_query = f"MERGE (n:agent {agent_property})"
-        neo4j_driver.execute_query(
+        self.execute_query(
+            neo4j_driver,
             query_=add_query,
             parameters_={"agent_name": full_name},
             database_="neo4j",
         )
 
-    def consolidate_node_athlete(self, neo4j_driver: Driver) -> int:
-        merge_query = """
-        MATCH(a1:athlete), (a2:athlete)
-        WHERE a1.id IS NULL AND a2.id IS NOT NULL
-        AND a1.name = a2.name
-        CALL apoc.refactor.mergeNodes([a1,a2]) YIELD node
-        RETURN node
-        """
-        merge_result = neo4j_driver.execute_query(
-            query_=merge_query,
+    def get_checkpoint(self, checkpoint_name: str, neo4j_driver: Driver) -> int | None:
+        get_query = (
+            "MATCH (c:etl_checkpoint {name: $name})\nRETURN c.last_run AS last_run"
+        )
+        get_result = self.execute_query(
+            neo4j_driver,
+            query_=get_query,
+            parameters_={"name": checkpoint_name},
             database_="neo4j",
         )
-        for node_athlete in merge_result.records:
-            print(node_athlete)
-        return len(merge_result.records)
-
-    def consolidate_node_team(self, neo4j_driver: Driver) -> int:
-        update_query = """
-        MATCH (t2:team)<-[c2:compete_for]-(a:athlete)-[c1:compete_for]->(t1:team)
-        WHERE upper(t2.name_short) = t2.name_short
-        AND t1.name = t2.name
-        AND t1.name_short <> t2.name_short
-        SET c2.first_date = c1.first_date, c2.last_date = c1.last_date
-        """
-        merge_query = """
-        MATCH(t1:team), (t2:team)
-        WHERE upper(t2.name_short) = t2.name_short
-        AND t1.name = t2.name
-        AND t1.name_short <> t2.name_short
-        CALL apoc.refactor.mergeNodes([t1,t2]) YIELD node
-        RETURN node
-        """
-        neo4j_driver.execute_query(
-            query_=update_query,
+        if len(get_result.records) == 0:
+            return None
+        return get_result.records[0]["last_run"]
+
+    def set_checkpoint(
+        self, checkpoint_name: str, last_run: int, neo4j_driver: Driver
+    ) -> None:
+        set_query = "MERGE (c:etl_checkpoint {name: $name})\nSET c.last_run = $last_run"
+        self.execute_query(
+            neo4j_driver,
+            query_=set_query,
+            parameters_={"name": checkpoint_name, "last_run": last_run},
             database_="neo4j",
         )
-        merge_result = neo4j_driver.execute_query(
-            query_=merge_query,
+
+    def get_db_timestamp(self, neo4j_driver: Driver) -> int:
+        # server clock, comparable with the last_updated written by the loaders
+        time_result = self.execute_query(
+            neo4j_driver,
+            query_="RETURN timestamp() AS now",
+            database_="neo4j",
+        )
+        return time_result.records[0]["now"]
+
+    def find_duplicate_nodes(
+        self, node_label: str, since: int | None, neo4j_driver: Driver
+    ) -> list[dict]:
+        find_query = TOUCHED_NODES_CLAUSE[since is not None].format(label=node_label)
+        if node_label == "athlete":
+            find_query += FIND_DUPLICATE_ATHLETES_QUERY
+        else:
+            find_query += FIND_DUPLICATE_TEAMS_QUERY
+        find_result = self.execute_query(
+            neo4j_driver,
+            query_=find_query,
+            parameters_={"since": since},
             database_="neo4j",
         )
-        for node_team in merge_result.records:
-            print(node_team)
-        return len(merge_result.records)
+        return [duplicate.data() for duplicate in find_result.records]
+
+    def merge_duplicate_nodes(
+        self,
+        node_label: str,
+        node_pairs: list[dict],
+        neo4j_driver: Driver,
+        batch_size: int = 500,
+    ) -> int:
+        merge_query = (
+            MERGE_ATHLETES_QUERY if node_label == "athlete" else MERGE_TEAMS_QUERY
+        )
+        pair_batches = chunk_list(node_pairs, batch_size)
+        num_merged = 0
+        # one transaction per batch keeps memory bounded on large graphs
+        for batch_id, pair_batch in enumerate(pair_batches):
+            merge_result = self.execute_query(
+                neo4j_driver,
+                query_=merge_query,
+                parameters_={"pairs": pair_batch},
+                database_="neo4j",
+            )
+            num_merged += merge_result.records[0]["num_merged"]
+            print(
+                f"{node_label} batch {batch_id + 1}/{len(pair_batches)}:",
+                f"{num_merged} of {len(node_pairs)} merged",
+            )
+        return num_merged
+
+    def consolidate_node_athlete(
+        self, neo4j_driver: Driver, since: int | None = None, batch_size: int = 500
+    ) -> int:
+        node_pairs = []
+        for duplicate in self.find_duplicate_nodes("athlete", since, neo4j_driver):
+            if len(duplicate["keep_ids"]) > 1:
+                print(f"{len(duplicate['keep_ids'])} matches found: {duplicate}")
+                continue
+            node_pairs.append(
+                {"merge_id": duplicate["merge_id"], "keep_id": duplicate["keep_ids"][0]}
+            )
+        return self.merge_duplicate_nodes(
+            "athlete", node_pairs, neo4j_driver, batch_size
+        )
+
+    def consolidate_node_team(
+        self, neo4j_driver: Driver, since: int | None = None, batch_size: int = 500
+    ) -> int:
+        node_pairs = self.find_duplicate_nodes("team", since, neo4j_driver)
+        return self.merge_duplicate_nodes("team", node_pairs, neo4j_driver, batch_size)
+
+    def find_rollup_athlete_days(
+        self, since: int | None, neo4j_driver: Driver
+    ) -> list[dict]:
+        find_query = TOUCHED_NODES_CLAUSE[since is not None].format(label="game")
+        find_query += FIND_ROLLUP_ATHLETE_DAYS_QUERY
+        find_result = self.execute_query(
+            neo4j_driver,
+            query_=find_query,
+            parameters_={"since": since},
+            database_="neo4j",
+        )
+        return [athlete_day.data() for athlete_day in find_result.records]
+
+    def write_athlete_rollups(
+        self, rollup_rows: list[dict], neo4j_driver: Driver, batch_size: int = 500
+    ) -> int:
+        for row_chunk in chunk_list(rollup_rows, batch_size):
+            self.execute_query(
+                neo4j_driver,
+                query_=UPSERT_ATHLETE_ROLLUPS_QUERY,
+                parameters_={"rows": row_chunk},
+                database_="neo4j",
+            )
+        return len(rollup_rows)
+
+    def load_team_history(self, window_days: int = 7) -> TeamHistoryIndex:
+        team_history = TeamHistoryIndex(window_days)
+        with self.get_db_session() as session:
+            current_teams = session.run(CURRENT_TEAMS_QUERY)
+            team_history.load(
+                (current["athlete_id"], current["team_id"], current["last_date"])
+                for current in current_teams
+            )
+        self.team_history = team_history
+        print(team_history)
+        return team_history
+
+    def find_team_stints(self, neo4j_driver: Driver) -> list[dict]:
+        find_result = self.execute_query(
+            neo4j_driver, query_=FIND_TEAM_STINTS_QUERY, database_="neo4j"
+        )
+        return [athlete_stints.data() for athlete_stints in find_result.records]
+
+    def write_team_changes(
+        self, change_rows: list[dict], neo4j_driver: Driver, batch_size: int = 500
+    ) -> int:
+        for row_chunk in chunk_list(change_rows, batch_size):
+            self.execute_query(
+                neo4j_driver,
+                query_=UPSERT_TEAM_CHANGES_QUERY,
+                parameters_={"rows": row_chunk},
+                database_="neo4j",
+            )
+        return len(change_rows)
+
+    def get_team_history(self, window_days: int = 7) -> TeamHistoryIndex:
+        # loaded once per instance, later calls only move the window
+        if self.team_history is None:
+            return self.load_team_history(window_days)
+        self.team_history.window_days = window_days
+        return self.team_history
+
+    def plan_team_history(
+        self, graphs_pydantic_sports: list[GraphSports]
+    ) -> TeamHistoryPlan | None:
+        if self.team_history is None:
+            return None
+        compete_for_rows = [
+            generate_edge_row(athlete_team)
+            for graph_pydantic_sports in graphs_pydantic_sports
+            for athlete_team in graph_pydantic_sports.athlete_compete_for_team
+        ]
+        return self.team_history.plan(compete_for_rows)
+
+    def write_graphs_pydantic_batch(
+        self,
+        neo4j_tx: ManagedTransaction,
+        graphs_pydantic_sports: list[GraphSports],
+        team_plan: TeamHistoryPlan | None = None,
+    ) -> int:
+        num_queries = 0
+        # Nodes first, one UNWIND per label
+        node_groups = group_nodes_pydantic(graphs_pydantic_sports)
+        for node_label, node_rows in node_groups.items():
+            self.run_query(neo4j_tx, NODE_BATCH_QUERIES[node_label], rows=node_rows)
+            num_queries += 1
+        # Edges, one UNWIND per edge type
+        edge_groups = group_edges_pydantic(graphs_pydantic_sports)
+        if team_plan is not None:
+            # compete_for only where the team changed or last_date fell out of window
+            edge_groups[AthleteCompeteFor] = team_plan.rows
+        for edge_type, edge_rows in edge_groups.items():
+            if len(edge_rows) == 0:
+                continue
+            self.run_query(neo4j_tx, EDGE_BATCH_QUERIES[edge_type], rows=edge_rows)
+            num_queries += 1
+        if team_plan is not None and len(team_plan.changes) > 0:
+            self.run_query(neo4j_tx, UPSERT_TEAM_CHANGES_QUERY, rows=team_plan.changes)
+            num_queries += 1
+        return num_queries
+
+    def add_graphs_pydantic_batch(
+        self, graphs_pydantic_sports: list[GraphSports], neo4j_driver: Driver
+    ) -> int:
+        # all games handed in commit together in a single write transaction
+        team_plan = self.plan_team_history(graphs_pydantic_sports)
+        with neo4j_driver.session(database="neo4j") as session:
+            num_queries = session.execute_write(
+                self.write_graphs_pydantic_batch, graphs_pydantic_sports, team_plan
+            )
+        # the history only moves forward once the transaction has committed
+        if team_plan is not None:
+            self.team_history.commit(team_plan)
+        return num_queries
 
     def add_nodes_pydantic(
         self, graph_pydantic_sports: GraphSports, neo4j_driver: Driver
@@ -137,47 +752,63 @@ class GraphNeo4j:
         MATCH (ag:agent)-[r:represent]->(at:athlete)
         RETURN ag.name AS agent_name, at.name AS athlete_name
         """
-        edge_results = neo4j_driver.execute_query(
+        edge_results = self.execute_query(
+            neo4j_driver,
             query_=get_query,
             database_="neo4j",
         )
         print(f"{len(edge_results.records)} agent-athlete edges")
         return [agent_athlete.data() for agent_athlete in edge_results.records]
 
+    def stream_edge_agent_athlete(
+        self, neo4j_session: Session, since: int | None = None
+    ) -> Iterator[tuple[str, str]]:
+        # records are pulled in fetch_size pages instead of all at once
+        get_query = "MATCH (ag:agent)-[r:represent]->(at:athlete)\n"
+        if since is not None:
+            get_query += "WHERE r.created_at >= $since\n"
+        get_query += "RETURN ag.name AS agent_name, at.name AS athlete_name"
+        edge_results = neo4j_session.run(get_query, since=since)
+        for agent_athlete in edge_results:
+            yield agent_athlete["agent_name"], agent_athlete["athlete_name"]
+
+    def get_gds_client(self) -> "GraphDataScience":
+        # imported here, it is slow to import and only the gds backend needs it
+        from graphdatascience import GraphDataScience
+
+        # wraps the shared driver, closing the client leaves the driver open
+        return GraphDataScience(self.get_db_driver(), database="neo4j", arrow=False)
+
+    def stream_community_agent_athlete(
+        self, graph_name: str = "agent_athlete"
+    ) -> list[set[str]]:
+        gds = self.get_gds_client()
+        query_params = {"graph_name": graph_name}
+        try:
+            gds.run_cypher(GDS_DROP_GRAPH_QUERY, query_params)
+            projection = gds.run_cypher(GDS_PROJECT_AGENT_ATHLETE_QUERY, query_params)
+            print(
+                f"GDS projection with {projection['node_count'][0]} nodes",
+                f"and {projection['edge_count'][0]} edges",
+            )
+            # only (name, community id) pairs come back over the wire
+            community_ids = gds.run_cypher(
+                GDS_LOUVAIN_STREAM_QUERY, query_params, mode="READ"
+            )
+        finally:
+            gds.run_cypher(GDS_DROP_GRAPH_QUERY, query_params)
+            gds.close()
+        return [
+            set(community_member)
+            for _, community_member in community_ids.groupby("community_id")["name"]
+        ]
+
     def add_edge_generic(self, edge_pydantic: Edge, neo4j_driver: Driver):
-        edge_attributes = edge_pydantic.model_dump()
-        edge_label = edge_attributes.pop("relation_type")
-        node_from = edge_attributes.pop("from_node_id")
-        node_to = edge_attributes.pop("to_node_id")
-        # customized for different edge types
-        if isinstance(edge_pydantic, AthleteCompeteIn):
-            edge_attributes = {}
-            for athlete_stats in edge_pydantic.stats:
-                edge_attributes[athlete_stats.stats_name] = athlete_stats.stats_value
-            edge_property = self.generate_query_params(edge_attributes)
-            edge_query = (
-                f"MATCH (a:athlete), (g:game)\n"
-                f"WHERE a.id = {node_from} AND g.id = {node_to}\n"
-                f"MERGE (a)-[:{edge_label} {edge_property}]->(g)"
-            )
-        elif isinstance(edge_pydantic, AthleteCompeteFor):
-            edge_query = (
-                f"MATCH (a:athlete), (t:team)\n"
-                f"WHERE a.id = {node_from} AND t.id = {node_to}\n"
-                f"MERGE (a)-[e:{edge_label}]->(t)\n"
-                f"ON CREATE SET e.jersey = $jersey, e.first_date = $date\n"
-                f"ON MATCH SET e.last_date = $date\n"
-            )
-        elif isinstance(edge_pydantic, TeamCompeteIn):
-            edge_property = self.generate_query_params(edge_attributes)
-            edge_query = (
-                f"MATCH (t:team), (g:game)\n"
-                f"WHERE t.id = {node_from} AND g.id = {node_to}\n"
-                f"MERGE (t)-[:{edge_label} {edge_property}]->(g)"
-            )
-        neo4j_driver.execute_query(
-            query_=edge_query,
-            parameters_=edge_attributes,
+        # same query text as the batched path, so the server reuses one plan
+        self.execute_query(
+            neo4j_driver,
+            query_=EDGE_BATCH_QUERIES[type(edge_pydantic)],
+            parameters_={"rows": [generate_edge_row(edge_pydantic)]},
             database_="neo4j",
         )
 
@@ -187,14 +818,59 @@ class GraphNeo4j:
         add_query = """
             MATCH (t:athlete), (g:agent)
             WHERE t.name = $athlete_name AND g.name IN $agent_names
-            MERGE (t)<-[:represent]-(g)
+            MERGE (t)<-[r:represent]-(g)
+            ON CREATE SET r.created_at = timestamp()
         """
-        neo4j_driver.execute_query(
+        self.execute_query(
+            neo4j_driver,
             query_=add_query,
             parameters_={"athlete_name": athlete_name, "agent_names": agent_names},
             database_="neo4j",
         )
 
+    def add_nodes_athlete_bulk(
+        self, athlete_names: list[str], neo4j_driver: Driver, chunk_size: int = 1000
+    ) -> list[dict]:
+        ambiguous_athletes = []
+        for name_chunk in chunk_list(list(dict.fromkeys(athlete_names)), chunk_size):
+            upsert_result = self.execute_query(
+                neo4j_driver,
+                query_=UPSERT_ATHLETES_QUERY,
+                parameters_={"names": name_chunk},
+                database_="neo4j",
+            )
+            ambiguous_athletes.extend(match.data() for match in upsert_result.records)
+            if self.athlete_index is not None:
+                for athlete_name in name_chunk:
+                    self.athlete_index.add_merged(athlete_name)
+        for match in ambiguous_athletes:
+            print(f"{match['num_match']} matches found: {match['name']}")
+            if self.athlete_index is not None:
+                self.athlete_index.set_count(match["name"], match["num_match"])
+        return ambiguous_athletes
+
+    def add_nodes_agent_bulk(
+        self, agent_names: list[str], neo4j_driver: Driver, chunk_size: int = 1000
+    ) -> None:
+        for name_chunk in chunk_list(list(dict.fromkeys(agent_names)), chunk_size):
+            self.execute_query(
+                neo4j_driver,
+                query_=UPSERT_AGENTS_QUERY,
+                parameters_={"names": name_chunk},
+                database_="neo4j",
+            )
+
+    def add_edges_agent_athlete_bulk(
+        self, athlete_agents: list[dict], neo4j_driver: Driver, chunk_size: int = 1000
+    ) -> None:
+        for row_chunk in chunk_list(athlete_agents, chunk_size):
+            self.execute_query(
+                neo4j_driver,
+                query_=UPSERT_EDGES_AGENT_ATHLETE_QUERY,
+                parameters_={"rows": row_chunk},
+                database_="neo4j",
+            )
+
     def add_edges_pydantic(
         self, graph_pydantic_sports: GraphSports, neo4j_driver: Driver
     ):
@@ -202,12 +878,38 @@ class GraphNeo4j:
         for athlete_game in graph_pydantic_sports.athlete_compete_in_game:
             self.add_edge_generic(athlete_game, neo4j_driver)
         # Athlete -> Team
-        for athlete_team in graph_pydantic_sports.athlete_compete_for_team:
-            self.add_edge_generic(athlete_team, neo4j_driver)
+        team_plan = self.plan_team_history([graph_pydantic_sports])
+        if team_plan is None:
+            for athlete_team in graph_pydantic_sports.athlete_compete_for_team:
+                self.add_edge_generic(athlete_team, neo4j_driver)
+        else:
+            self.add_edges_team_history(team_plan, neo4j_driver)
         # Team -> Game
         for team_game in graph_pydantic_sports.team_compete_in_game:
             self.add_edge_generic(team_game, neo4j_driver)
 
+    def add_edges_team_history(
+        self, team_plan: TeamHistoryPlan, neo4j_driver: Driver
+    ) -> None:
+        if len(team_plan.rows) > 0:
+            self.execute_query(
+                neo4j_driver,
+                query_=EDGE_BATCH_QUERIES[AthleteCompeteFor],
+                parameters_={"rows": team_plan.rows},
+                database_="neo4j",
+            )
+        if len(team_plan.changes) > 0:
+            self.execute_query(
+                neo4j_driver,
+                query_=UPSERT_TEAM_CHANGES_QUERY,
+                parameters_={"rows": team_plan.changes},
+                database_="neo4j",
+            )
+        self.team_history.commit(team_plan)
+
+
+atexit.register(GraphNeo4j.close_all)
+
 
 class GraphNetworkx:
     def __init__(self, graph_name: str = "", graph_content: nx.Graph | None = None):
@@ -0,0 +1,316 @@
+import os
+import time
+import asyncio
+from dotenv import load_dotenv
+from neo4j import AsyncDriver, AsyncGraphDatabase, AsyncManagedTransaction
+from etl.graphs import (
+    SCHEMA_QUERIES,
+    ID_CONSTRAINT_LABELS,
+    SHOW_CONSTRAINT_NAMES_QUERY,
+    DEDUPE_NODES_BY_ID_QUERY,
+    NODE_BATCH_QUERIES,
+    EDGE_BATCH_QUERIES,
+    CURRENT_TEAMS_QUERY,
+    UPSERT_TEAM_CHANGES_QUERY,
+    UPSERT_ATHLETES_QUERY,
+    UPSERT_AGENTS_QUERY,
+    UPSERT_EDGES_AGENT_ATHLETE_QUERY,
+    chunk_list,
+    generate_edge_row,
+    group_edges_pydantic,
+    group_nodes_pydantic,
+)
+from etl.instrumentation import PROFILE, get_summary_counters
+from etl.models import AthleteCompeteFor, GraphSports
+from etl.team_history import TeamHistoryIndex, TeamHistoryPlan
+
+load_dotenv()
+
+# Write ordering, so concurrent transactions do not queue on the same locks:
+# 1. nodes shared across games (teams, athletes) are upserted first, in one
+#    transaction, label by label with rows sorted by id, so locks are always
+#    taken in the same order;
+# 2. games then load concurrently under a semaphore, each in its own write
+#    transaction holding its game node and edges, rows sorted by endpoint ids.
+#    The shared nodes already exist, so MERGE only takes short read/relationship
+#    locks on them, and a game's edges touch its own two teams and their leaders.
+#    compete_for rows and team changes are planned per game beforehand, in date
+#    order, against the team history as the earlier games leave it;
+# 3. agent and athlete names upsert concurrently by chunk, but agent->athlete
+#    edges go one chunk at a time: agents are hubs shared by many athletes and
+#    parallel chunks would just wait on (or deadlock over) the same agent nodes.
+# Deadlocks and other transient errors that still happen are retried by the
+# driver's managed transactions, up to max_transaction_retry_time.
+
+
+def sort_rows(rows: list[dict], *keys: str) -> list[dict]:
+    return sorted(rows, key=lambda row: tuple(str(row[key]) for key in keys))
+
+
+class AsyncGraphNeo4j:
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        max_connection_pool_size: int = 50,
+        max_transaction_retry_time: float = 30.0,
+        neo4j_driver: AsyncDriver | None = None,
+    ):
+        self.neo4j_driver = neo4j_driver
+        self.neo4j_uri = os.getenv("NEO4J_URL")
+        self.neo4j_auth = (os.getenv("NEO4J_USERNAME"), os.getenv("NEO4J_PASSWORD"))
+        self.driver_config = {
+            "max_connection_pool_size": max_connection_pool_size,
+            "max_transaction_retry_time": max_transaction_retry_time,
+        }
+        # one bound for every concurrent write this writer issues
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.schema_ready = False
+        self.team_history: TeamHistoryIndex | None = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def get_db_driver(self) -> AsyncDriver:
+        # async drivers belong to one event loop, so this one is not pooled globally
+        if self.neo4j_driver is None:
+            self.neo4j_driver = AsyncGraphDatabase.driver(
+                uri=self.neo4j_uri, auth=self.neo4j_auth, **self.driver_config
+            )
+            await self.neo4j_driver.verify_connectivity()
+        return self.neo4j_driver
+
+    async def close(self) -> None:
+        if self.neo4j_driver is not None:
+            await self.neo4j_driver.close()
+            self.neo4j_driver = None
+
+    async def execute_query(self, query_: str, parameters_: dict | None = None):
+        # auto-retried like execute_write, and recorded like GraphNeo4j.execute_query
+        neo4j_driver = await self.get_db_driver()
+        query_start = time.perf_counter()
+        query_result = await neo4j_driver.execute_query(
+            query_, parameters_, database_="neo4j"
+        )
+        PROFILE.record_query(
+            query_,
+            time.perf_counter() - query_start,
+            len(query_result.records),
+            get_summary_counters(query_result.summary),
+        )
+        return query_result
+
+    async def run_query(
+        self, neo4j_tx: AsyncManagedTransaction, query: str, **parameters
+    ):
+        query_start = time.perf_counter()
+        query_result = await neo4j_tx.run(query, **parameters)
+        result_summary = await query_result.consume()
+        PROFILE.record_query(
+            query,
+            time.perf_counter() - query_start,
+            0,
+            get_summary_counters(result_summary),
+        )
+        return result_summary
+
+    async def execute_write(self, transaction_function, *args):
+        # managed transaction: transient errors, deadlocks included, are retried
+        neo4j_driver = await self.get_db_driver()
+        async with neo4j_driver.session(database="neo4j") as session:
+            return await session.execute_write(transaction_function, *args)
+
+    async def write_queries(
+        self, neo4j_tx: AsyncManagedTransaction, queries: list[tuple[str, dict]]
+    ) -> int:
+        for query, parameters in queries:
+            await self.run_query(neo4j_tx, query, **parameters)
+        return len(queries)
+
+    async def bootstrap_schema(self) -> None:
+        if self.schema_ready:
+            return
+        # same migration as GraphNeo4j.dedupe_nodes_by_id, before the constraints
+        constraint_result = await self.execute_query(SHOW_CONSTRAINT_NAMES_QUERY)
+        constraint_names = constraint_result.records[0]["names"]
+        for node_label in ID_CONSTRAINT_LABELS:
+            if f"{node_label}_id" not in constraint_names:
+                await self.execute_query(
+                    DEDUPE_NODES_BY_ID_QUERY.format(label=node_label)
+                )
+        for schema_query in SCHEMA_QUERIES:
+            await self.execute_query(schema_query)
+        self.schema_ready = True
+
+    def get_node_queries(
+        self, graphs_pydantic_sports: list[GraphSports], node_labels: list[str]
+    ) -> list[tuple[str, dict]]:
+        node_groups = group_nodes_pydantic(graphs_pydantic_sports)
+        return [
+            (
+                NODE_BATCH_QUERIES[node_label],
+                {"rows": sort_rows(node_groups[node_label], "id")},
+            )
+            for node_label in node_labels
+            if len(node_groups.get(node_label, [])) > 0
+        ]
+
+    def get_edge_queries(
+        self,
+        graphs_pydantic_sports: list[GraphSports],
+        team_plan: TeamHistoryPlan | None = None,
+    ) -> list[tuple[str, dict]]:
+        edge_groups = group_edges_pydantic(graphs_pydantic_sports)
+        if team_plan is not None:
+            # compete_for only where the team changed or last_date fell out of window
+            edge_groups[AthleteCompeteFor] = team_plan.rows
+        edge_queries = [
+            (
+                EDGE_BATCH_QUERIES[edge_type],
+                {"rows": sort_rows(edge_rows, "from_node_id", "to_node_id")},
+            )
+            for edge_type, edge_rows in edge_groups.items()
+            if len(edge_rows) > 0
+        ]
+        if team_plan is not None and len(team_plan.changes) > 0:
+            edge_queries.append(
+                (
+                    UPSERT_TEAM_CHANGES_QUERY,
+                    {"rows": sort_rows(team_plan.changes, "athlete_id", "date")},
+                )
+            )
+        return edge_queries
+
+    async def load_team_history(self, window_days: int = 7) -> TeamHistoryIndex:
+        team_history = TeamHistoryIndex(window_days)
+        current_teams = await self.execute_query(CURRENT_TEAMS_QUERY)
+        team_history.load(
+            (current["athlete_id"], current["team_id"], current["last_date"])
+            for current in current_teams.records
+        )
+        self.team_history = team_history
+        print(team_history)
+        return team_history
+
+    async def get_team_history(self, window_days: int = 7) -> TeamHistoryIndex:
+        if self.team_history is None:
+            return await self.load_team_history(window_days)
+        self.team_history.window_days = window_days
+        return self.team_history
+
+    def plan_team_history(
+        self, graphs_pydantic_sports: list[GraphSports]
+    ) -> list[TeamHistoryPlan | None]:
+        # games run concurrently, so each is planned up front against a working
+        # copy that already holds the earlier games' updates
+        if self.team_history is None:
+            return [None] * len(graphs_pydantic_sports)
+        working_history = self.team_history.copy()
+        team_plans = []
+        for graph_pydantic_sports in graphs_pydantic_sports:
+            team_plan = working_history.plan(
+                [
+                    generate_edge_row(athlete_team)
+                    for athlete_team in graph_pydantic_sports.athlete_compete_for_team
+                ]
+            )
+            working_history.commit(team_plan)
+            team_plans.append(team_plan)
+        return team_plans
+
+    async def add_shared_nodes_pydantic(
+        self, graphs_pydantic_sports: list[GraphSports]
+    ) -> int:
+        node_queries = self.get_node_queries(
+            graphs_pydantic_sports, ["team", "athlete"]
+        )
+        return await self.execute_write(self.write_queries, node_queries)
+
+    async def add_game_pydantic(
+        self,
+        graph_pydantic_sports: GraphSports,
+        team_plan: TeamHistoryPlan | None = None,
+    ) -> int:
+        game_queries = self.get_node_queries([graph_pydantic_sports], ["game"])
+        game_queries += self.get_edge_queries([graph_pydantic_sports], team_plan)
+        async with self.semaphore:
+            return await self.execute_write(self.write_queries, game_queries)
+
+    async def add_graphs_pydantic(
+        self, graphs_pydantic_sports: list[GraphSports]
+    ) -> tuple[int, list[str]]:
+        # one failed game does not cancel the others, its id is handed back instead
+        await self.bootstrap_schema()
+        num_queries = await self.add_shared_nodes_pydantic(graphs_pydantic_sports)
+        graphs_pydantic_sports = sorted(
+            graphs_pydantic_sports, key=lambda graph: graph.game.date
+        )
+        team_plans = self.plan_team_history(graphs_pydantic_sports)
+        game_results = await asyncio.gather(
+            *[
+                self.add_game_pydantic(graph_pydantic_sports, team_plan)
+                for graph_pydantic_sports, team_plan in zip(
+                    graphs_pydantic_sports, team_plans
+                )
+            ],
+            return_exceptions=True,
+        )
+        failed_game_ids = []
+        for graph_pydantic_sports, game_result in zip(
+            graphs_pydantic_sports, game_results
+        ):
+            if isinstance(game_result, Exception):
+                print(f"Game {graph_pydantic_sports.game.id} not loaded: {game_result}")
+                failed_game_ids.append(str(graph_pydantic_sports.game.id))
+                continue
+            num_queries += game_result
+        # games after a failed one ran on plans that assumed its updates, so the
+        # cached history is dropped and reloaded from the database next batch
+        if len(failed_game_ids) > 0:
+            self.team_history = None
+            return num_queries, failed_game_ids
+        for team_plan in team_plans:
+            if team_plan is not None:
+                self.team_history.commit(team_plan)
+        return num_queries, failed_game_ids
+
+    async def add_names_bulk(
+        self, upsert_query: str, names: list[str], chunk_size: int = 1000
+    ) -> list[dict]:
+        async def upsert_chunk(name_chunk: list[str]) -> list[dict]:
+            async with self.semaphore:
+                upsert_result = await self.execute_query(
+                    upsert_query, {"names": name_chunk}
+                )
+            return [match.data() for match in upsert_result.records]
+
+        name_chunks = chunk_list(sorted(set(names)), chunk_size)
+        chunk_results = await asyncio.gather(*map(upsert_chunk, name_chunks))
+        return [match for chunk_result in chunk_results for match in chunk_result]
+
+    async def add_nodes_athlete_bulk(
+        self, athlete_names: list[str], chunk_size: int = 1000
+    ) -> list[dict]:
+        ambiguous_athletes = await self.add_names_bulk(
+            UPSERT_ATHLETES_QUERY, athlete_names, chunk_size
+        )
+        for match in ambiguous_athletes:
+            print(f"{match['num_match']} matches found: {match['name']}")
+        return ambiguous_athletes
+
+    async def add_nodes_agent_bulk(
+        self, agent_names: list[str], chunk_size: int = 1000
+    ) -> None:
+        await self.add_names_bulk(UPSERT_AGENTS_QUERY, agent_names, chunk_size)
+
+    async def add_edges_agent_athlete_bulk(
+        self, athlete_agents: list[dict], chunk_size: int = 1000
+    ) -> None:
+        # sequential on purpose, see the ordering notes at the top of the module
+        athlete_agents = sort_rows(athlete_agents, "athlete_name")
+        for row_chunk in chunk_list(athlete_agents, chunk_size):
+            await self.execute_query(
+                UPSERT_EDGES_AGENT_ATHLETE_QUERY, {"rows": row_chunk}
+            )
@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import requests
+from datetime import date, datetime, timedelta
+
+
+class RateLimiter:
+    def __init__(self, requests_per_second: float):
+        self.interval = 1.0 / requests_per_second
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        # reserve the next slot under the lock, sleep outside of it
+        with self.lock:
+            now = time.monotonic()
+            wait_time = max(0.0, self.next_time - now)
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+def get_scoreboard_final_after(event_date: date) -> float:
+    # a scoreboard fetched once its date is older than yesterday no longer changes,
+    # one fetched earlier may still hold games in progress
+    final_date = event_date + timedelta(days=2)
+    return datetime(final_date.year, final_date.month, final_date.day).timestamp()
+
+
+class ResponseCache:
+    def __init__(self, cache_dir: str, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __str__(self):
+        return (
+            f"HTTP cache with {self.hits} hits, {self.revalidated} revalidated "
+            f"and {self.misses} misses"
+        )
+
+    def get_stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+        }
+
+    def get_cache_key(self, url: str, params: dict | None) -> str:
+        # headers are left out on purpose, they carry API keys
+        key_source = json.dumps({"url": url, "params": params or {}}, sort_keys=True)
+        return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+    def get_entry_paths(self, cache_key: str) -> tuple[str, str]:
+        entry_path = os.path.join(self.cache_dir, cache_key)
+        return f"{entry_path}.meta.json", f"{entry_path}.body"
+
+    def read_entry(self, cache_key: str) -> tuple[dict, bytes] | None:
+        meta_path, body_path = self.get_entry_paths(cache_key)
+        try:
+            with open(meta_path, "r") as meta_file:
+                entry_meta = json.load(meta_file)
+            with open(body_path, "rb") as body_file:
+                entry_body = body_file.read()
+        except (OSError, ValueError):
+            return None
+        return entry_meta, entry_body
+
+    def write_entry(self, cache_key: str, entry_meta: dict, entry_body: bytes) -> None:
+        meta_path, body_path = self.get_entry_paths(cache_key)
+        # write-then-rename so concurrent readers never see a partial entry
+        with open(f"{body_path}.tmp", "wb") as body_file:
+            body_file.write(entry_body)
+        os.replace(f"{body_path}.tmp", body_path)
+        with open(f"{meta_path}.tmp", "w") as meta_file:
+            json.dump(entry_meta, meta_file)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+    def touch_entry(self, cache_key: str) -> None:
+        meta_path, _ = self.get_entry_paths(cache_key)
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+
+    def evict(self) -> None:
+        # least recently used first, until the cache fits in max_bytes
+        entries = {}
+        cache_size = 0
+        for file_name in os.listdir(self.cache_dir):
+            file_path = os.path.join(self.cache_dir, file_name)
+            cache_key = file_name.split(".")[0]
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                continue
+            cache_size += file_stat.st_size
+            last_used, entry_size = entries.get(cache_key, (0.0, 0))
+            entries[cache_key] = (
+                max(last_used, file_stat.st_mtime),
+                entry_size + file_stat.st_size,
+            )
+        for cache_key, (_, entry_size) in sorted(
+            entries.items(), key=lambda entry: entry[1][0]
+        ):
+            if cache_size <= self.max_bytes:
+                break
+            for entry_path in self.get_entry_paths(cache_key):
+                try:
+                    os.remove(entry_path)
+                except OSError:
+                    pass
+            cache_size -= entry_size
+
+    def get(
+        self,
+        url: str,
+        params: dict | None = None,
+        headers: dict | None = None,
+        max_age: float | None = None,
+        http_session: requests.Session | None = None,
+        final_after: float | None = None,
+        rate_limiter: RateLimiter | None = None,
+    ) -> bytes:
+        # max_age None marks the response as immutable, final_after marks it
+        # immutable only when it was fetched after that timestamp
+        cache_key = self.get_cache_key(url, params)
+        cache_entry = self.read_entry(cache_key)
+        if cache_entry is not None:
+            entry_meta, entry_body = cache_entry
+            entry_age = time.time() - entry_meta["fetched_at"]
+            if max_age is None or entry_meta.get("final") or entry_age < max_age:
+                with self.lock:
+                    self.hits += 1
+                self.touch_entry(cache_key)
+                return entry_body
+
+        request_headers = dict(headers or {})
+        if cache_entry is not None:
+            if entry_meta.get("etag"):
+                request_headers["If-None-Match"] = entry_meta["etag"]
+            if entry_meta.get("last_modified"):
+                request_headers["If-Modified-Since"] = entry_meta["last_modified"]
+        if rate_limiter is not None:
+            # only requests that reach the network count against the limit
+            rate_limiter.wait()
+        http_client = requests if http_session is None else http_session
+        response = http_client.get(url=url, params=params, headers=request_headers)
+
+        if cache_entry is not None and response.status_code == 304:
+            with self.lock:
+                self.revalidated += 1
+            entry_meta["fetched_at"] = time.time()
+            entry_meta["final"] = final_after is not None and (
+                entry_meta["fetched_at"] >= final_after
+            )
+            self.write_entry(cache_key, entry_meta, entry_body)
+            return entry_body
+
+        assert response.status_code == 200, f"HTTP {response.status_code}"
+        with self.lock:
+            self.misses += 1
+        fetched_at = time.time()
+        entry_meta = {
+            "url": url,
+            "params": params,
+            "fetched_at": fetched_at,
+            "final": final_after is not None and fetched_at >= final_after,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        self.write_entry(cache_key, entry_meta, response.content)
+        self.evict()
+        return response.content
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import inspect
+import threading
+import functools
+from collections.abc import Callable
+from contextlib import contextmanager
+from datetime import datetime
+
+QUERY_COUNTERS = (
+    "nodes_created",
+    "nodes_deleted",
+    "relationships_created",
+    "relationships_deleted",
+    "properties_set",
+)
+
+
+def get_query_key(query: str, max_length: int = 120) -> str:
+    # whitespace-normalized statement text, the same query always lands together
+    return " ".join(query.split())[:max_length]
+
+
+def get_summary_counters(result_summary) -> dict:
+    return {
+        counter: getattr(result_summary.counters, counter) for counter in QUERY_COUNTERS
+    }
+
+
+class RunProfile:
+    def __init__(self, run_name: str = "etl"):
+        self.run_name = run_name
+        self.started_at = datetime.now()
+        # spans can close on fetch threads and the checkpoint writer
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.queries = {}
+
+    def record_stage(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            stage_stats = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0})
+            stage_stats["count"] += 1
+            stage_stats["seconds"] += seconds
+
+    @contextmanager
+    def span(self, stage: str):
+        span_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter() - span_start)
+
+    def record_query(
+        self, query: str, seconds: float, num_rows: int, counters: dict
+    ) -> None:
+        query_key = get_query_key(query)
+        with self.lock:
+            query_stats = self.queries.setdefault(
+                query_key,
+                {"count": 0, "seconds": 0.0, "rows": 0}
+                | {counter: 0 for counter in QUERY_COUNTERS},
+            )
+            query_stats["count"] += 1
+            query_stats["seconds"] += seconds
+            query_stats["rows"] += num_rows
+            for counter in QUERY_COUNTERS:
+                query_stats[counter] += counters.get(counter, 0)
+
+    def get_query_count(self) -> int:
+        with self.lock:
+            return sum(query_stats["count"] for query_stats in self.queries.values())
+
+    def get_report(self) -> dict:
+        with self.lock:
+            query_totals = {"count": 0, "seconds": 0.0, "rows": 0} | {
+                counter: 0 for counter in QUERY_COUNTERS
+            }
+            for query_stats in self.queries.values():
+                for stat_name in query_totals:
+                    query_totals[stat_name] += query_stats[stat_name]
+            return {
+                "run_name": self.run_name,
+                "started_at": self.started_at.isoformat(),
+                "wall_seconds": (datetime.now() - self.started_at).total_seconds(),
+                "stages": {stage: dict(stats) for stage, stats in self.stages.items()},
+                "query_totals": query_totals,
+                "queries": sorted(
+                    [{"query": query} | stats for query, stats in self.queries.items()],
+                    key=lambda query_stats: query_stats["seconds"],
+                    reverse=True,
+                ),
+            }
+
+    def write_report(self, report_dir: str) -> str:
+        os.makedirs(report_dir, exist_ok=True)
+        run_time = self.started_at.strftime("%Y%m%dT%H%M%S")
+        report_path = os.path.join(report_dir, f"{self.run_name}_{run_time}.json")
+        with open(report_path, "w") as report_file:
+            json.dump(self.get_report(), report_file, indent=2)
+        print(f"run report written to {report_path}")
+        return report_path
+
+    def reset(self, run_name: str | None = None) -> None:
+        with self.lock:
+            self.run_name = self.run_name if run_name is None else run_name
+            self.started_at = datetime.now()
+            self.stages = {}
+            self.queries = {}
+
+
+# one profile per process, every module records into it
+PROFILE = RunProfile()
+
+
+def span(stage: str):
+    return PROFILE.span(stage)
+
+
+def timed(stage: str) -> Callable:
+    def decorator(function: Callable) -> Callable:
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with PROFILE.span(stage):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with PROFILE.span(stage):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -1,9 +1,14 @@
-from collections import defaultdict
 import os
 import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import date, timedelta
 from langchain_openai import ChatOpenAI
+from langchain_core.language_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate
+from pydantic import BaseModel
+from etl.graph_store import GraphSportsStore
 from etl.models import (
     GraphSports,
     Game,
@@ -17,8 +22,18 @@ from etl.models import (
 
 
 class GraphPydanticManual:
-    def __init__(self):
-        pass
+    def __init__(self, fast_construct: bool = False):
+        self.fast_construct = fast_construct
+
+    def build_model(self, model_type: type[BaseModel], **model_fields) -> BaseModel:
+        # fast_construct keeps the parts as plain dicts and validates the whole
+        # GraphSports in one pydantic-core call; model_construct is slower than
+        # validation on pydantic 2, so skipping validation does not pay off
+        if self.fast_construct and model_type is not GraphSports:
+            return model_fields
+        if self.fast_construct:
+            return GraphSports.model_validate(model_fields)
+        return model_type(**model_fields)
 
     def navigate_event_to_competition(self, input_event: dict) -> dict:
         competition = input_event["competitions"]
@@ -40,99 +55,92 @@ class GraphPydanticManual:
     def navigate_competitor_to_leaders(self, input_competitor: dict) -> list:
         return input_competitor["leaders"]
 
-    def navigate_leaders_to_athletes(self, input_leaders: list) -> dict:
-        athletes = {}
-        for input_leader in input_leaders:
-            if input_leader["name"] == "rating":
-                continue
-            leader = input_leader["leaders"]
-            if len(leader) > 1:
-                print(f"{len(leader)} leaders in {input_leader['name']}")
-            athlete = leader[0]["athlete"]
-            athletes[athlete["id"]] = athlete
-        return athletes
-
-    def navigate_leaders_to_stats(self, input_leaders: list) -> dict:
-        stats = defaultdict(list)
-        for input_leader in input_leaders:
-            if input_leader["name"] == "rating":
-                continue
-            leader = input_leader["leaders"]
-            if len(leader) > 1:
-                print(f"{len(leader)} leaders in {input_leader['name']}")
-            athlete = leader[0]["athlete"]
-            stats[athlete["id"]].append(
-                {
-                    "stats_name": input_leader["name"],
-                    "stats_value": leader[0]["value"],
-                }
-            )
-        return stats
-
     def extract_game_from_event(self, input_event: dict) -> Game:
-        return Game(
-            id=input_event["id"],
+        return self.build_model(
+            Game,
+            id=int(input_event["id"]),
             label="game",
             name=input_event["name"],
             date=input_event["date"],
         )
 
     def extract_team_from_team(self, input_team: dict) -> Team:
-        return Team(
-            id=input_team["id"],
+        return self.build_model(
+            Team,
+            id=int(input_team["id"]),
             label="team",
             name=input_team["displayName"],
             name_short=input_team["abbreviation"],
         )
 
-    def extract_athletes_from_athletes(self, input_athletes: dict) -> list[Athlete]:
-        return [
-            Athlete(
-                id=athlete_id,
-                label="athlete",
-                name=athlete_info["fullName"],
-                name_short=athlete_info["shortName"],
-            )
-            for athlete_id, athlete_info in input_athletes.items()
-        ]
-
     def connect_team_to_game(
         self, input_competitor: dict, input_competition: dict
     ) -> TeamCompeteIn:
-        return TeamCompeteIn(
-            from_node_id=input_competitor["team"]["id"],
-            to_node_id=input_competition["id"],
+        return self.build_model(
+            TeamCompeteIn,
+            from_node_id=int(input_competitor["team"]["id"]),
+            to_node_id=int(input_competition["id"]),
             relation_type="compete_in",
             home_or_away=input_competitor["homeAway"],
             is_winner=input_competitor["winner"],
         )
 
-    def connect_athletes_to_team(
-        self, input_athletes: dict, input_competition: dict, input_team: dict
-    ) -> list[AthleteCompeteFor]:
-        return [
-            AthleteCompeteFor(
-                from_node_id=athlete_id,
-                to_node_id=input_team["id"],
-                relation_type="compete_for",
-                date=input_competition["date"],
-                jersey=athlete_info["jersey"],
+    def extract_leaders_to_graph(
+        self, input_leaders: list, input_competition: dict, input_team: dict
+    ) -> tuple[list[Athlete], list[AthleteCompeteFor], list[AthleteCompeteIn]]:
+        # one walk over the leaders builds athletes, their stats and both edges
+        team_id = int(input_team["id"])
+        game_id = int(input_competition["id"])
+        output_athletes = []
+        output_athlete_team = []
+        athlete_stats = {}
+        for input_leader in input_leaders:
+            if input_leader["name"] == "rating":
+                continue
+            leader = input_leader["leaders"]
+            if len(leader) > 1:
+                print(f"{len(leader)} leaders in {input_leader['name']}")
+            athlete = leader[0]["athlete"]
+            athlete_id = int(athlete["id"])
+            if athlete_id not in athlete_stats:
+                athlete_stats[athlete_id] = []
+                output_athletes.append(
+                    self.build_model(
+                        Athlete,
+                        id=athlete_id,
+                        label="athlete",
+                        name=athlete["fullName"],
+                        name_short=athlete["shortName"],
+                    )
+                )
+                output_athlete_team.append(
+                    self.build_model(
+                        AthleteCompeteFor,
+                        from_node_id=athlete_id,
+                        to_node_id=team_id,
+                        relation_type="compete_for",
+                        date=input_competition["date"],
+                        jersey=int(athlete["jersey"]),
+                    )
+                )
+            athlete_stats[athlete_id].append(
+                self.build_model(
+                    AthleteStats,
+                    stats_name=input_leader["name"],
+                    stats_value=leader[0]["value"],
+                )
             )
-            for athlete_id, athlete_info in input_athletes.items()
-        ]
-
-    def connect_athletes_to_game(
-        self, input_stats: dict, input_competition: dict
-    ) -> list[AthleteCompeteIn]:
-        return [
-            AthleteCompeteIn(
+        output_athlete_game = [
+            self.build_model(
+                AthleteCompeteIn,
                 from_node_id=athlete_id,
-                to_node_id=input_competition["id"],
+                to_node_id=game_id,
                 relation_type="compete_in",
-                stats=[AthleteStats.model_validate(stat) for stat in athlete_stats],
+                stats=stats,
             )
-            for athlete_id, athlete_stats in input_stats.items()
+            for athlete_id, stats in athlete_stats.items()
         ]
+        return output_athletes, output_athlete_team, output_athlete_game
 
     def transform_graph_pydantic(self, input_event: dict):
         output_game = self.extract_game_from_event(input_event)
@@ -147,23 +155,19 @@ class GraphPydanticManual:
         for input_competitor in input_competitors:
             input_team = self.navigate_competitor_to_team(input_competitor)
             input_leaders = self.navigate_competitor_to_leaders(input_competitor)
-            input_athletes = self.navigate_leaders_to_athletes(input_leaders)
-            input_stats = self.navigate_leaders_to_stats(input_leaders)
+            athletes, athlete_team, athlete_game = self.extract_leaders_to_graph(
+                input_leaders, input_competition, input_team
+            )
             output_teams.append(self.extract_team_from_team(input_team))
-            output_athletes.extend(self.extract_athletes_from_athletes(input_athletes))
+            output_athletes.extend(athletes)
             output_team_game.append(
                 self.connect_team_to_game(input_competitor, input_competition)
             )
-            output_athlete_team.extend(
-                self.connect_athletes_to_team(
-                    input_athletes, input_competition, input_team
-                )
-            )
-            output_athlete_game.extend(
-                self.connect_athletes_to_game(input_stats, input_competition)
-            )
+            output_athlete_team.extend(athlete_team)
+            output_athlete_game.extend(athlete_game)
 
-        return GraphSports(
+        return self.build_model(
+            GraphSports,
             athletes=output_athletes,
             teams=output_teams,
             game=output_game,
@@ -172,10 +176,90 @@ class GraphPydanticManual:
             team_compete_in_game=output_team_game,
         )
 
+    def transform_graph_pydantic_safe(
+        self, input_event: dict
+    ) -> tuple[GraphSports | None, str | None]:
+        # errors travel back as text, pydantic errors do not always pickle
+        try:
+            return self.transform_graph_pydantic(input_event), None
+        except Exception as transform_error:
+            return None, f"{type(transform_error).__name__}: {transform_error}"
+
+    def transform_graph_pydantic_batch(
+        self,
+        input_events: list[dict],
+        max_workers: int = 1,
+        use_processes: bool = True,
+        chunk_size: int = 16,
+    ) -> tuple[list[GraphSports | None], list[tuple[int, str]]]:
+        time_start = time.perf_counter()
+        if max_workers <= 1:
+            transform_results = list(
+                map(self.transform_graph_pydantic_safe, input_events)
+            )
+        else:
+            executor_type = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+            with executor_type(max_workers=max_workers) as executor:
+                # map keeps the output in input order
+                transform_results = list(
+                    executor.map(
+                        self.transform_graph_pydantic_safe,
+                        input_events,
+                        chunksize=chunk_size,
+                    )
+                )
+        time_elapsed = time.perf_counter() - time_start
+
+        output_graphs = [output_graph for output_graph, _ in transform_results]
+        output_errors = [
+            (event_id, transform_error)
+            for event_id, (_, transform_error) in enumerate(transform_results)
+            if transform_error is not None
+        ]
+        for event_id, transform_error in output_errors:
+            print(f"event {event_id} not transformed: {transform_error}")
+        print(
+            f"{len(input_events)} events transformed in {time_elapsed:.3f}s",
+            f"({len(input_events) / max(time_elapsed, 1e-9):.1f} events/s),",
+            f"{len(output_errors)} errors",
+        )
+        return output_graphs, output_errors
+
+
+def benchmark_transform(input_events: list[dict], repeat: int = 5) -> dict:
+    # e.g. input_events = json.load(open("data/<date>/raw_events.json"))
+    benchmark = {"events": len(input_events)}
+    for mode_name, fast_construct in [("per_model", False), ("fast_construct", True)]:
+        graph_pydantic_manual = GraphPydanticManual(fast_construct=fast_construct)
+        time_best = float("inf")
+        for _ in range(repeat):
+            time_start = time.perf_counter()
+            for input_event in input_events:
+                graph_pydantic_manual.transform_graph_pydantic(input_event)
+            time_best = min(time_best, time.perf_counter() - time_start)
+        benchmark[mode_name] = time_best
+        print(
+            f"{mode_name}: {len(input_events)} events in {time_best:.4f}s",
+            f"({len(input_events) / max(time_best, 1e-9):.1f} events/s)",
+        )
+    speedup = benchmark["per_model"] / benchmark["fast_construct"]
+    print(f"fast_construct speedup {speedup:.2f}x")
+    return benchmark
+
 
 class GraphPydanticChain:
-    def __init__(self, prompt_file_path: str):
-        self.llm = ChatOpenAI(model="gpt-4o-2024-08-06", temperature=0)
+    def __init__(
+        self,
+        prompt_file_path: str,
+        model_name: str = "gpt-4o-2024-08-06",
+        llm: BaseChatModel | None = None,
+        cache_dir: str | None = None,
+    ):
+        # llm can be swapped for benchmark.RecordingChatModel to run offline
+        self.model_name = model_name
+        if llm is None:
+            llm = ChatOpenAI(model=model_name, temperature=0)
+        self.llm = llm
         with open(prompt_file_path, "r") as prompt_file:
             prompt_str = prompt_file.read()
         self.prompt = ChatPromptTemplate.from_messages(
@@ -188,26 +272,147 @@ class GraphPydanticChain:
                 ("human", "Tip: Make sure to answer in the correct format"),
             ]
         )
-        self.chain = self.prompt | self.llm.with_structured_output(schema=GraphSports)
+        self.chain = self.prompt | self.llm.with_structured_output(
+            schema=GraphSports, include_raw=True
+        )
+        self.cache_prefix = f"{prompt_str}\n{model_name}\n"
+        self.cache_dir = cache_dir
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        self.reset_stats()
 
-    def transform_graph_pydantic(self, input_doc: dict):
-        graph_sports: GraphSports = self.chain.invoke({"input": input_doc})
+    def reset_stats(self) -> None:
+        self.stats = {
+            "llm_calls": 0,
+            "cache_hits": 0,
+            "errors": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "latency_seconds": 0.0,
+        }
+
+    def get_cache_path(self, input_doc: dict) -> str | None:
+        if self.cache_dir is None:
+            return None
+        cache_source = self.cache_prefix + json.dumps(input_doc, sort_keys=True)
+        cache_key = hashlib.sha256(cache_source.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{cache_key}.json")
+
+    def read_cache(self, input_doc: dict) -> GraphSports | None:
+        cache_path = self.get_cache_path(input_doc)
+        if cache_path is None or not os.path.exists(cache_path):
+            return None
+        with open(cache_path, "r") as cache_file:
+            graph_sports = GraphSports.model_validate_json(cache_file.read())
+        self.stats["cache_hits"] += 1
+        return graph_sports
+
+    def write_cache(self, input_doc: dict, graph_sports: GraphSports) -> None:
+        cache_path = self.get_cache_path(input_doc)
+        if cache_path is None:
+            return
+        with open(f"{cache_path}.tmp", "w") as cache_file:
+            cache_file.write(graph_sports.model_dump_json())
+        os.replace(f"{cache_path}.tmp", cache_path)
+
+    def parse_chain_output(self, chain_output: dict | Exception) -> GraphSports | None:
+        if isinstance(chain_output, Exception) or chain_output["parsed"] is None:
+            self.stats["errors"] += 1
+            return None
+        usage_metadata = getattr(chain_output["raw"], "usage_metadata", None) or {}
+        self.stats["input_tokens"] += usage_metadata.get("input_tokens", 0)
+        self.stats["output_tokens"] += usage_metadata.get("output_tokens", 0)
+        graph_sports: GraphSports = chain_output["parsed"]
         assert type(graph_sports) == GraphSports
         return graph_sports
 
+    def transform_graph_pydantic(self, input_doc: dict):
+        graph_sports = self.read_cache(input_doc)
+        if graph_sports is not None:
+            return graph_sports
+        time_start = time.perf_counter()
+        chain_output = self.chain.invoke({"input": input_doc})
+        self.stats["latency_seconds"] += time.perf_counter() - time_start
+        self.stats["llm_calls"] += 1
+        graph_sports = self.parse_chain_output(chain_output)
+        assert graph_sports is not None, chain_output["parsing_error"]
+        self.write_cache(input_doc, graph_sports)
+        return graph_sports
+
+    def collect_batch_outputs(
+        self, input_docs: list[dict], output_graphs: list, chain_outputs: list
+    ) -> list[GraphSports | None]:
+        missed_ids = [
+            doc_id for doc_id, graph in enumerate(output_graphs) if graph is None
+        ]
+        self.stats["llm_calls"] += len(missed_ids)
+        for doc_id, chain_output in zip(missed_ids, chain_outputs):
+            graph_sports = self.parse_chain_output(chain_output)
+            if graph_sports is not None:
+                self.write_cache(input_docs[doc_id], graph_sports)
+            output_graphs[doc_id] = graph_sports
+        return output_graphs
+
+    def transform_graph_pydantic_batch(
+        self, input_docs: list[dict], max_concurrency: int = 4
+    ) -> list[GraphSports | None]:
+        # only cache misses reach the model; failed documents come back as None
+        output_graphs = [self.read_cache(input_doc) for input_doc in input_docs]
+        chain_inputs = [
+            {"input": input_doc}
+            for input_doc, graph in zip(input_docs, output_graphs)
+            if graph is None
+        ]
+        time_start = time.perf_counter()
+        chain_outputs = self.chain.batch(
+            chain_inputs,
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True,
+        )
+        self.stats["latency_seconds"] += time.perf_counter() - time_start
+        return self.collect_batch_outputs(input_docs, output_graphs, chain_outputs)
+
+    async def atransform_graph_pydantic_batch(
+        self, input_docs: list[dict], max_concurrency: int = 4
+    ) -> list[GraphSports | None]:
+        output_graphs = [self.read_cache(input_doc) for input_doc in input_docs]
+        chain_inputs = [
+            {"input": input_doc}
+            for input_doc, graph in zip(input_docs, output_graphs)
+            if graph is None
+        ]
+        time_start = time.perf_counter()
+        chain_outputs = await self.chain.abatch(
+            chain_inputs,
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True,
+        )
+        self.stats["latency_seconds"] += time.perf_counter() - time_start
+        return self.collect_batch_outputs(input_docs, output_graphs, chain_outputs)
+
 
 if __name__ == "__main__":
     yesterday = date.today() - timedelta(days=1)
     process_date = "2025-02-21"
+    graph_format = "json"
     graph_pydantic_manual = GraphPydanticManual()
-    # graph_pydantic_chain = GraphPydanticChain("prompts/json_to_graph_sports.md")
+    # graph_pydantic_chain = GraphPydanticChain(
+    #     "prompts/json_to_graph_sports.md", cache_dir="data/llm_cache"
+    # )
 
     with open(f"data/{process_date}/raw_events.json", "r") as input_file:
         input_data = json.load(input_file)
-    for each_input_doc in input_data:
-        # graph_data = graph_pydantic_chain.transform_graph_pydantic(each_input_doc)
-        graph_data = graph_pydantic_manual.transform_graph_pydantic(each_input_doc)
-        game_id = graph_data.game.id
-        os.makedirs(f"test/{process_date}", exist_ok=True)
-        with open(f"test/{process_date}/{game_id}.json", "w") as output_file:
-            json.dump(graph_data.model_dump(), output_file, indent=2)
+    # output_data = graph_pydantic_chain.transform_graph_pydantic_batch(input_data)
+    output_data, _ = graph_pydantic_manual.transform_graph_pydantic_batch(
+        input_data, max_workers=os.cpu_count()
+    )
+    output_data = [graph_data for graph_data in output_data if graph_data is not None]
+    if graph_format == "jsonl":
+        graph_store = GraphSportsStore(f"test/{process_date}")
+        graph_store.append(output_data)
+    else:
+        for graph_data in output_data:
+            game_id = graph_data.game.id
+            os.makedirs(f"test/{process_date}", exist_ok=True)
+            with open(f"test/{process_date}/{game_id}.json", "w") as output_file:
+                json.dump(graph_data.model_dump(), output_file, indent=2)
@@ -1,31 +1,61 @@
+import argparse
 import glob
 import os
-import sys
 import json
 from datetime import date, timedelta
 from dotenv import load_dotenv
 
 from etl.models import GraphSports
 from etl.graphs import GraphNeo4j
-from etl.api_to_json import get_espn_api_scoreboard, extract_events
+from etl.api_to_json import (
+    get_espn_api_scoreboard,
+    get_espn_api_scoreboards,
+    get_date_range,
+    extract_events,
+)
+from etl.http_cache import ResponseCache
+from etl.graph_store import GraphSportsStore
 from etl.json_to_pydantic import GraphPydanticManual
-from etl.pydantic_to_neo4j import build_graph
+from etl.manifest import IngestionManifest, get_manifest_path
+from etl.instrumentation import PROFILE, span
+from etl.pipeline import run_pipeline
+from etl.pydantic_to_neo4j import AsyncGraphLoader, build_graph_batch
 
 load_dotenv()
 
-if __name__ == "__main__":
-    data_dir = os.path.join(os.path.dirname(__file__), "..", "data")
-    yesterday = date.today() - timedelta(days=1)
-    sports_neo4j_data = GraphNeo4j()
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+
 
-    # Read from ESPN API and write to JSON document
-    sports_scoreboard = get_espn_api_scoreboard(yesterday)
+def load_graphs(
+    sports_neo4j_data: GraphNeo4j,
+    sports_graphs: list[GraphSports],
+    manifest: IngestionManifest | None = None,
+    window_days: int = 7,
+    async_loader: AsyncGraphLoader | None = None,
+) -> None:
+    if async_loader is not None:
+        async_loader.build_graph_batch(sports_graphs, manifest, window_days)
+        return
+    # the whole day commits in one transaction
+    build_graph_batch(sports_neo4j_data, sports_graphs, manifest, window_days)
+
+
+def process_scoreboard(
+    sports_neo4j_data: GraphNeo4j,
+    event_date: date,
+    sports_scoreboard: dict,
+    graph_format: str = "json",
+    transform_workers: int = 1,
+    manifest: IngestionManifest | None = None,
+    window_days: int = 7,
+    async_loader: AsyncGraphLoader | None = None,
+) -> None:
     sports_events = extract_events(sports_scoreboard)
     if len(sports_events) == 0:
-        sys.exit()
-    file_name_raw_json = f"{data_dir}/{yesterday}/raw_events.json"
+        return
+    file_name_raw_json = f"{DATA_DIR}/{event_date}/raw_events.json"
     os.makedirs(os.path.dirname(file_name_raw_json), exist_ok=True)
-    with open(file_name_raw_json, mode="w") as file_io:
+    with span("serialize"), open(file_name_raw_json, mode="w") as file_io:
         json.dump(sports_events, file_io, indent=2)
 
     # Read from raw JSON document and extract data per Pydantic
@@ -33,20 +63,210 @@ if __name__ == "__main__":
     graph_pydantic_manual = GraphPydanticManual()
     with open(file_name_raw_json, "r") as file_raw_json:
         sports_events = json.load(file_raw_json)
-    for sports_doc in sports_events:
-        sports_graph_data = graph_pydantic_manual.transform_graph_pydantic(sports_doc)
+    with span("transform"):
+        sports_graphs, _ = graph_pydantic_manual.transform_graph_pydantic_batch(
+            sports_events, max_workers=transform_workers
+        )
+    sports_graphs = [
+        sports_graph_data
+        for sports_graph_data in sports_graphs
+        if sports_graph_data is not None
+    ]
+    if graph_format == "jsonl":
+        graph_store = GraphSportsStore(f"{DATA_DIR}/{event_date}")
+        with span("serialize"):
+            graph_store.append(sports_graphs)
+        # the day is already in memory, no need to read the store back
+        load_graphs(
+            sports_neo4j_data, sports_graphs, manifest, window_days, async_loader
+        )
+        return
+    for sports_graph_data in sports_graphs:
         game_id = sports_graph_data.game.id
-        file_name_graph = f"{data_dir}/{yesterday}/{game_id}.json"
-        with open(file_name_graph, "w") as file_graph:
+        file_name_graph = f"{DATA_DIR}/{event_date}/{game_id}.json"
+        with span("serialize"), open(file_name_graph, "w") as file_graph:
             json.dump(sports_graph_data.model_dump(), file_graph, indent=2)
 
     # Read from Pydantic JSON document and write to Neo4J graph DB
-    file_name_graph = f"{data_dir}/{yesterday}/*.json"
+    file_name_graph = f"{DATA_DIR}/{event_date}/*.json"
+    sports_graph_data_list = []
     for file_path in glob.glob(file_name_graph):
-        if os.path.basename(file_path).split(".")[0] == "raw_events":
+        if os.path.basename(file_path).split(".")[0] in ["raw_events", "graphs"]:
             continue
         print(f"processing {file_path}")
         with open(file_path, "r") as input_file:
             sports_pydantic_data = json.load(input_file)
         sports_graph_data = GraphSports.model_validate(sports_pydantic_data)
-        build_graph(sports_neo4j_data, sports_graph_data)
+        sports_graph_data_list.append(sports_graph_data)
+    load_graphs(
+        sports_neo4j_data, sports_graph_data_list, manifest, window_days, async_loader
+    )
+
+
+def backfill(
+    sports_neo4j_data: GraphNeo4j,
+    start_date: date,
+    end_date: date,
+    max_workers: int = 8,
+    requests_per_second: float = 5.0,
+    max_retries: int = 3,
+    response_cache: ResponseCache | None = None,
+    stream: bool = False,
+    checkpoint: bool = True,
+    graph_format: str = "json",
+    transform_workers: int = 1,
+    manifest: IngestionManifest | None = None,
+    window_days: int = 7,
+    async_loader: AsyncGraphLoader | None = None,
+) -> list[date]:
+    event_dates = get_date_range(start_date, end_date)
+    print(f"backfilling {len(event_dates)} dates from {start_date} to {end_date}")
+    failed_dates = []
+    sports_scoreboards = get_espn_api_scoreboards(
+        event_dates,
+        max_workers=max_workers,
+        requests_per_second=requests_per_second,
+        max_retries=max_retries,
+        response_cache=response_cache,
+        failed_dates=failed_dates,
+    )
+    if stream:
+        checkpoint_dir = DATA_DIR if checkpoint else None
+        run_pipeline(
+            sports_neo4j_data,
+            sports_scoreboards,
+            checkpoint_dir,
+            graph_format,
+            manifest,
+            window_days,
+        )
+    else:
+        for event_date, sports_scoreboard in sports_scoreboards:
+            print(f"processing {event_date}")
+            process_scoreboard(
+                sports_neo4j_data,
+                event_date,
+                sports_scoreboard,
+                graph_format,
+                transform_workers,
+                manifest,
+                window_days,
+                async_loader,
+            )
+    # rerun these dates once the API answers for them again
+    if len(failed_dates) > 0:
+        print(f"{len(failed_dates)} dates not fetched: {failed_dates}")
+    return failed_dates
+
+
+if __name__ == "__main__":
+    yesterday = date.today() - timedelta(days=1)
+    parser = argparse.ArgumentParser(description="Load ESPN scoreboards into Neo4j")
+    parser.add_argument("--start-date", type=date.fromisoformat, default=None)
+    parser.add_argument("--end-date", type=date.fromisoformat, default=yesterday)
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--requests-per-second", type=float, default=5.0)
+    parser.add_argument("--max-retries", type=int, default=3)
+    parser.add_argument("--no-cache", action="store_true", help="skip the HTTP cache")
+    parser.add_argument(
+        "--stream", action="store_true", help="fetch, transform and load in memory"
+    )
+    parser.add_argument(
+        "--no-checkpoint",
+        action="store_true",
+        help="in streaming mode, do not write the intermediate JSON files",
+    )
+    parser.add_argument(
+        "--graph-format",
+        choices=["json", "jsonl"],
+        default="json",
+        help="one JSON file per game, or one indexed JSON Lines file per day",
+    )
+    parser.add_argument(
+        "--transform-workers",
+        type=int,
+        default=1,
+        help="processes used to transform the events of a day",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="reload games already in the manifest"
+    )
+    parser.add_argument(
+        "--team-window-days",
+        type=int,
+        default=7,
+        help="days an athlete's compete_for last_date may lag before it is rewritten",
+    )
+    parser.add_argument(
+        "--async-load",
+        action="store_true",
+        help="write each day's games concurrently, one transaction per game",
+    )
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    args = parser.parse_args()
+    if args.async_load and args.stream:
+        parser.error("--async-load does not apply to --stream")
+    response_cache = None
+    async_loader = None
+    if args.async_load:
+        async_loader = AsyncGraphLoader(args.max_concurrency)
+    if not args.no_cache:
+        response_cache = ResponseCache(f"{DATA_DIR}/http_cache")
+
+    with GraphNeo4j() as sports_neo4j_data:
+        manifest = None
+        if not args.force:
+            os.makedirs(DATA_DIR, exist_ok=True)
+            manifest = IngestionManifest(
+                get_manifest_path(DATA_DIR, sports_neo4j_data.neo4j_uri)
+            )
+        if args.start_date is None:
+            # Read from ESPN API and write to JSON document
+            sports_scoreboard = get_espn_api_scoreboard(
+                args.end_date, response_cache=response_cache
+            )
+            if args.stream:
+                checkpoint_dir = None if args.no_checkpoint else DATA_DIR
+                run_pipeline(
+                    sports_neo4j_data,
+                    [(args.end_date, sports_scoreboard)],
+                    checkpoint_dir,
+                    args.graph_format,
+                    manifest,
+                    args.team_window_days,
+                )
+            else:
+                process_scoreboard(
+                    sports_neo4j_data,
+                    args.end_date,
+                    sports_scoreboard,
+                    args.graph_format,
+                    args.transform_workers,
+                    manifest,
+                    args.team_window_days,
+                    async_loader,
+                )
+        else:
+            backfill(
+                sports_neo4j_data,
+                args.start_date,
+                args.end_date,
+                max_workers=args.max_workers,
+                requests_per_second=args.requests_per_second,
+                max_retries=args.max_retries,
+                response_cache=response_cache,
+                stream=args.stream,
+                checkpoint=not args.no_checkpoint,
+                graph_format=args.graph_format,
+                transform_workers=args.transform_workers,
+                manifest=manifest,
+                window_days=args.team_window_days,
+                async_loader=async_loader,
+            )
+    if async_loader is not None:
+        async_loader.close()
+    if response_cache is not None:
+        print(response_cache)
+    if manifest is not None:
+        manifest.close()
+    PROFILE.write_report(f"{DATA_DIR}/reports")
@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from etl.models import GraphSports
+
+MANIFEST_KIND_GAME = "game"
+MANIFEST_KIND_AGENT_ROW = "agent_row"
+# keys per IN (...) lookup, under SQLite's bound-parameter limit
+MANIFEST_LOOKUP_CHUNK = 500
+
+
+def get_manifest_path(
+    manifest_dir: str, neo4j_uri: str | None, database: str = "neo4j"
+) -> str:
+    # one manifest per target database, a fresh database starts with an empty one
+    target_key = hashlib.sha256(f"{neo4j_uri}/{database}".encode()).hexdigest()
+    return os.path.join(manifest_dir, f"manifest_{target_key[:16]}.sqlite")
+
+
+def hash_graph_sports(graph_pydantic_sports: GraphSports) -> str:
+    return hashlib.sha256(graph_pydantic_sports.model_dump_json().encode()).hexdigest()
+
+
+def hash_agent_row(athlete_name: str, agent_names: list[str]) -> str:
+    row_source = json.dumps([athlete_name, sorted(agent_names)])
+    return hashlib.sha256(row_source.encode()).hexdigest()
+
+
+class IngestionManifest:
+    def __init__(self, manifest_path: str):
+        # item kind + key -> content hash of what was last written to Neo4j
+        self.connection = sqlite3.connect(manifest_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS ingested ("
+                "kind TEXT NOT NULL, item_key TEXT NOT NULL, "
+                "content_hash TEXT NOT NULL, loaded_at REAL NOT NULL, "
+                "PRIMARY KEY (kind, item_key))"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def filter_changed(self, kind: str, item_hashes: dict[str, str]) -> set[str]:
+        # only the keys asked about are read, so the cost follows the input size
+        item_keys = list(item_hashes)
+        loaded_hashes = {}
+        with self.lock:
+            for chunk_start in range(0, len(item_keys), MANIFEST_LOOKUP_CHUNK):
+                key_chunk = item_keys[chunk_start : chunk_start + MANIFEST_LOOKUP_CHUNK]
+                key_params = ", ".join("?" * len(key_chunk))
+                loaded_hashes.update(
+                    self.connection.execute(
+                        "SELECT item_key, content_hash FROM ingested "
+                        f"WHERE kind = ? AND item_key IN ({key_params})",
+                        (kind, *key_chunk),
+                    )
+                )
+        return {
+            item_key
+            for item_key, content_hash in item_hashes.items()
+            if loaded_hashes.get(item_key) != content_hash
+        }
+
+    def record(self, kind: str, item_hashes: dict[str, str]) -> None:
+        loaded_at = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO ingested VALUES (?, ?, ?, ?)",
+                [
+                    (kind, item_key, content_hash, loaded_at)
+                    for item_key, content_hash in item_hashes.items()
+                ],
+            )
+
+    def filter_graphs(
+        self, graphs_pydantic_sports: list[GraphSports]
+    ) -> tuple[list[GraphSports], dict[str, str]]:
+        graph_hashes = {
+            str(graph.game.id): hash_graph_sports(graph)
+            for graph in graphs_pydantic_sports
+        }
+        changed_keys = self.filter_changed(MANIFEST_KIND_GAME, graph_hashes)
+        changed_graphs = [
+            graph
+            for graph in graphs_pydantic_sports
+            if str(graph.game.id) in changed_keys
+        ]
+        changed_hashes = {key: graph_hashes[key] for key in changed_keys}
+        num_skipped = len(graphs_pydantic_sports) - len(changed_graphs)
+        if num_skipped > 0:
+            print(f"{num_skipped} of {len(graphs_pydantic_sports)} games unchanged")
+        return changed_graphs, changed_hashes
+
+    def record_graphs(self, graph_hashes: dict[str, str]) -> None:
+        self.record(MANIFEST_KIND_GAME, graph_hashes)
@@ -1,22 +1,122 @@
+import os
+import argparse
 from dotenv import load_dotenv
 from etl.graphs import GraphNeo4j
+from etl.instrumentation import PROFILE, timed
+from etl.team_history import build_team_change_rows
 
 load_dotenv()
 
+CHECKPOINT_CONSOLIDATE = "consolidate_nodes"
+CHECKPOINT_ROLLUP = "athlete_rollups"
+CHECKPOINT_TEAM_CHANGES = "team_changes_backfill"
+REPORT_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "reports")
 
-def neo4j_merge_nodes(graph_neo4j: GraphNeo4j) -> None:
-    with graph_neo4j.get_db_driver() as driver:
-        num_athlete_consolidated = graph_neo4j.consolidate_node_athlete(driver)
-        num_team_consolidated = graph_neo4j.consolidate_node_team(driver)
-        print(
-            f"{num_athlete_consolidated} athletes and ",
-            f"{num_team_consolidated} teams consolidated",
+
+@timed("post_process")
+def neo4j_merge_nodes(
+    graph_neo4j: GraphNeo4j, full_scan: bool = False, batch_size: int = 500
+) -> None:
+    driver = graph_neo4j.get_db_driver()
+    # only nodes written since the previous run can have become duplicates
+    run_start = graph_neo4j.get_db_timestamp(driver)
+    since = None
+    if not full_scan:
+        since = graph_neo4j.get_checkpoint(CHECKPOINT_CONSOLIDATE, driver)
+    print(f"consolidating nodes touched since {since}")
+    num_athlete_consolidated = graph_neo4j.consolidate_node_athlete(
+        driver, since, batch_size
+    )
+    num_team_consolidated = graph_neo4j.consolidate_node_team(driver, since, batch_size)
+    # after consolidation, so the constraints meet a graph with one node per id
+    graph_neo4j.bootstrap_schema(driver)
+    graph_neo4j.set_checkpoint(CHECKPOINT_CONSOLIDATE, run_start, driver)
+    print(
+        f"{num_athlete_consolidated} athletes and ",
+        f"{num_team_consolidated} teams consolidated",
+    )
+
+
+@timed("post_process")
+def neo4j_backfill_team_changes(
+    graph_neo4j: GraphNeo4j, full_scan: bool = False, batch_size: int = 500
+) -> int:
+    # one-off: changed_team edges for trades loaded before the loader wrote them,
+    # rebuilt from each athlete's compete_for edges; MERGE on date keeps it safe
+    # to repeat with --full
+    driver = graph_neo4j.get_db_driver()
+    graph_neo4j.bootstrap_schema(driver)
+    if not full_scan:
+        if graph_neo4j.get_checkpoint(CHECKPOINT_TEAM_CHANGES, driver) is not None:
+            return 0
+    run_start = graph_neo4j.get_db_timestamp(driver)
+    change_rows = [
+        change_row
+        for athlete_stints in graph_neo4j.find_team_stints(driver)
+        for change_row in build_team_change_rows(
+            athlete_stints["athlete_id"], athlete_stints["stints"]
+        )
+    ]
+    num_changes = graph_neo4j.write_team_changes(change_rows, driver, batch_size)
+    graph_neo4j.set_checkpoint(CHECKPOINT_TEAM_CHANGES, run_start, driver)
+    print(f"{num_changes} team changes backfilled from compete_for edges")
+    return num_changes
+
+
+def build_rollup_row(athlete_id: int, date: str, stats: list[dict]) -> dict:
+    # total_stats keeps the old meaning: number of stats led, summed over games
+    totals = {"games": len(stats), "total_stats": sum(map(len, stats))}
+    for game_stats in stats:
+        for stats_name, stats_value in game_stats.items():
+            totals[f"sum_{stats_name}"] = (
+                totals.get(f"sum_{stats_name}", 0) + stats_value
+            )
+    return {"athlete_id": athlete_id, "date": date, "totals": totals}
+
+
+@timed("post_process")
+def neo4j_rollup_athletes(
+    graph_neo4j: GraphNeo4j, full_scan: bool = False, batch_size: int = 500
+) -> int:
+    driver = graph_neo4j.get_db_driver()
+    graph_neo4j.bootstrap_schema(driver)
+    # only athlete-days with a game loaded since the previous run are rebuilt
+    run_start = graph_neo4j.get_db_timestamp(driver)
+    since = None
+    if not full_scan:
+        since = graph_neo4j.get_checkpoint(CHECKPOINT_ROLLUP, driver)
+    athlete_days = graph_neo4j.find_rollup_athlete_days(since, driver)
+    rollup_rows = [
+        build_rollup_row(
+            athlete_day["athlete_id"], athlete_day["date"], athlete_day["stats"]
         )
+        for athlete_day in athlete_days
+    ]
+    num_rollups = graph_neo4j.write_athlete_rollups(rollup_rows, driver, batch_size)
+    graph_neo4j.set_checkpoint(CHECKPOINT_ROLLUP, run_start, driver)
+    print(f"{num_rollups} athlete-day rollups rebuilt from games since {since}")
+    return num_rollups
 
 
 def post_process():
-    graph_data = GraphNeo4j()
-    neo4j_merge_nodes(graph_data)
+    parser = argparse.ArgumentParser(
+        description="Consolidate nodes, backfill team changes, roll up athlete stats"
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="ignore the checkpoint, scan every node"
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    PROFILE.reset("post_process")
+    with GraphNeo4j() as graph_data:
+        neo4j_merge_nodes(graph_data, full_scan=args.full, batch_size=args.batch_size)
+        neo4j_backfill_team_changes(
+            graph_data, full_scan=args.full, batch_size=args.batch_size
+        )
+        neo4j_rollup_athletes(
+            graph_data, full_scan=args.full, batch_size=args.batch_size
+        )
+    PROFILE.write_report(REPORT_DIR)
 
 
 if __name__ == "__main__":
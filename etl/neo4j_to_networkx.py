@@ -1,9 +1,110 @@
+import os
+import json
+import numpy as np
+import networkx as nx
 from etl.graphs import GraphNeo4j, GraphNetworkx
 
 
+class NameIndex:
+    def __init__(self, names: list[str] | None = None):
+        # name <-> integer id, ids are dense and stable across refreshes
+        self.names = [] if names is None else list(names)
+        self.ids = {name: name_id for name_id, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_id(self, name: str) -> int:
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.ids[name] = name_id
+            self.names.append(name)
+        return name_id
+
+
+class EdgeSnapshot:
+    def __init__(
+        self,
+        edges: np.ndarray | None = None,
+        names: NameIndex | None = None,
+        watermark: int | None = None,
+    ):
+        # edges holds (agent id, athlete id) rows
+        self.edges = np.empty((0, 2), dtype=np.int32) if edges is None else edges
+        self.names = NameIndex() if names is None else names
+        self.watermark = watermark
+
+    def __str__(self):
+        return f"Snapshot with {len(self.names)} names and {len(self.edges)} edges"
+
+    def save(self, snapshot_dir: str) -> None:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        np.save(os.path.join(snapshot_dir, "edges.npy"), self.edges)
+        with open(os.path.join(snapshot_dir, "names.json"), "w") as names_file:
+            json.dump(
+                {"names": self.names.names, "watermark": self.watermark}, names_file
+            )
+
+    @classmethod
+    def load(cls, snapshot_dir: str) -> "EdgeSnapshot":
+        edges = np.load(os.path.join(snapshot_dir, "edges.npy"))
+        with open(os.path.join(snapshot_dir, "names.json"), "r") as names_file:
+            snapshot_meta = json.load(names_file)
+        return cls(edges, NameIndex(snapshot_meta["names"]), snapshot_meta["watermark"])
+
+    def add_edges(self, edge_list: list[tuple[str, str]]) -> int:
+        new_edges = np.array(
+            [
+                (self.names.get_id(agent_name), self.names.get_id(athlete_name))
+                for agent_name, athlete_name in edge_list
+            ],
+            dtype=np.int32,
+        ).reshape(-1, 2)
+        num_edges = len(self.edges)
+        self.edges = np.unique(np.concatenate([self.edges, new_edges]), axis=0)
+        return len(self.edges) - num_edges
+
+    def refresh(self, graph: GraphNeo4j, full: bool = False) -> int:
+        # only edges created since the previous refresh are pulled; a full refresh
+        # pulls every edge again, so edges deleted in Neo4j leave the snapshot
+        driver = graph.get_db_driver()
+        refresh_start = graph.get_db_timestamp(driver)
+        since = None if full else self.watermark
+        with graph.get_db_session() as session:
+            edge_stream = graph.stream_edge_agent_athlete(session, since)
+            if full:
+                num_old_edges = len(self.edges)
+                self.edges = np.empty((0, 2), dtype=np.int32)
+            num_new_edges = self.add_edges(list(edge_stream))
+        self.watermark = refresh_start
+        if full:
+            print(f"{num_old_edges} -> {len(self.edges)} agent-athlete edges, {self}")
+        else:
+            print(f"{num_new_edges} new agent-athlete edges, {self}")
+        return num_new_edges
+
+    def to_networkx(self, graph_name: str = "agent_athlete") -> GraphNetworkx:
+        graph_networkx = GraphNetworkx(graph_name)
+        names = self.names.names
+        graph_networkx.add_edges(
+            [
+                (names[agent_id], names[athlete_id])
+                for agent_id, athlete_id in self.edges
+            ]
+        )
+        return graph_networkx
+
+    def to_networkx_ids(self, graph_name: str = "agent_athlete") -> GraphNetworkx:
+        # integer nodes, names are looked up in self.names only when needed
+        graph_ids = nx.Graph()
+        graph_ids.add_edges_from(self.edges.tolist())
+        return GraphNetworkx(graph_name, graph_ids)
+
+
 def neo4j_get_edges_agent_athlete(graph: GraphNeo4j) -> list:
-    with graph.get_db_driver() as driver:
-        neo4j_edges = graph.get_edge_agent_athlete(driver)
+    driver = graph.get_db_driver()
+    neo4j_edges = graph.get_edge_agent_athlete(driver)
     result_edge_list = [
         (agent_athlete["agent_name"], agent_athlete["athlete_name"])
         for agent_athlete in neo4j_edges
@@ -19,6 +120,36 @@ def convert_agent_athlete_neo4j_networkx(graph_neo4j: GraphNeo4j) -> GraphNetwor
     return graph_networkx
 
 
+def load_agent_athlete_snapshot(
+    graph_neo4j: GraphNeo4j,
+    snapshot_dir: str,
+    refresh: bool = True,
+    full_refresh: bool = False,
+) -> EdgeSnapshot:
+    if os.path.exists(os.path.join(snapshot_dir, "edges.npy")):
+        edge_snapshot = EdgeSnapshot.load(snapshot_dir)
+    else:
+        edge_snapshot = EdgeSnapshot()
+    if refresh or full_refresh or edge_snapshot.watermark is None:
+        edge_snapshot.refresh(graph_neo4j, full=full_refresh)
+        edge_snapshot.save(snapshot_dir)
+    return edge_snapshot
+
+
+def convert_agent_athlete_snapshot_networkx(
+    graph_neo4j: GraphNeo4j,
+    snapshot_dir: str,
+    refresh: bool = True,
+    full_refresh: bool = False,
+) -> GraphNetworkx:
+    edge_snapshot = load_agent_athlete_snapshot(
+        graph_neo4j, snapshot_dir, refresh, full_refresh
+    )
+    graph_networkx = edge_snapshot.to_networkx()
+    print(graph_networkx)
+    return graph_networkx
+
+
 if __name__ == "__main__":
-    graph_neo4j = GraphNeo4j()
-    graph_networkx = convert_agent_athlete_neo4j_networkx(graph_neo4j)
+    with GraphNeo4j() as graph_neo4j:
+        graph_networkx = convert_agent_athlete_neo4j_networkx(graph_neo4j)
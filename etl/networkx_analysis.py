@@ -1,42 +1,177 @@
+import os
+import argparse
 import networkx as nx
-from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from etl.graphs import GraphNeo4j, GraphNetworkx
-from etl.neo4j_to_networkx import convert_agent_athlete_neo4j_networkx
+from etl.community_partition import update_partition_file
+from etl.graph_render import GraphRenderer
+from etl.neo4j_to_networkx import convert_agent_athlete_snapshot_networkx
 
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "snapshot")
+PARTITION_PATH = os.path.join(SNAPSHOT_DIR, "partition.json")
+RENDER_DIR = os.path.join(os.path.dirname(__file__), "..", "test")
 
-def detect_community_agent_athlete(graph_networkx: GraphNetworkx) -> None:
-    community_agent_athlete: list[set] = nx.community.louvain_communities(
-        graph_networkx.graph
+
+@dataclass
+class CommunityBridge:
+    pair_id: tuple[int, int]
+    community_sizes: tuple[int, int]
+    members: frozenset
+    bridge_edges: set[tuple]
+
+
+def get_adjacent_community_pairs(
+    graph: nx.Graph, communities: list[set]
+) -> list[tuple[int, int]]:
+    # quotient graph: two communities are adjacent if any edge runs between them
+    node_community = {
+        node: community_id
+        for community_id, community_member in enumerate(communities)
+        for node in community_member
+    }
+    community_pairs = set()
+    for node_from, node_to in graph.edges():
+        community_from = node_community.get(node_from)
+        community_to = node_community.get(node_to)
+        if community_from is None or community_to is None:
+            continue
+        if community_from != community_to:
+            community_pairs.add(
+                (min(community_from, community_to), max(community_from, community_to))
+            )
+    return sorted(community_pairs)
+
+
+def find_community_bridge(
+    pair_id: tuple[int, int], community_sizes: tuple[int, int], graph_pair: nx.Graph
+) -> CommunityBridge | None:
+    if not nx.is_connected(graph_pair):
+        return None
+    return CommunityBridge(
+        pair_id=pair_id,
+        community_sizes=community_sizes,
+        members=frozenset(graph_pair.nodes()),
+        bridge_edges=nx.minimum_edge_cut(graph_pair),
+    )
+
+
+def get_community_agent_athlete(
+    graph_networkx: GraphNetworkx,
+    backend: str = "networkx",
+    graph_neo4j: GraphNeo4j | None = None,
+    partition_path: str | None = None,
+    full_recompute: bool = False,
+) -> list[set]:
+    if backend == "networkx":
+        if partition_path is None:
+            return nx.community.louvain_communities(graph_networkx.graph)
+        return update_partition_file(
+            graph_networkx.graph, partition_path, full_recompute
+        )
+    if backend == "gds":
+        if graph_neo4j is None:
+            raise ValueError("the gds backend needs a GraphNeo4j connection")
+        return graph_neo4j.stream_community_agent_athlete()
+    raise ValueError(f"unknown community detection backend {backend}")
+
+
+def detect_community_agent_athlete(
+    graph_networkx: GraphNetworkx,
+    min_size: int = 10,
+    max_workers: int = 1,
+    backend: str = "networkx",
+    graph_neo4j: GraphNeo4j | None = None,
+    partition_path: str | None = None,
+    full_recompute: bool = False,
+) -> list[CommunityBridge]:
+    community_agent_athlete = get_community_agent_athlete(
+        graph_networkx, backend, graph_neo4j, partition_path, full_recompute
     )
     community_agent_athlete_large = [
         community_member
         for community_member in community_agent_athlete
-        if len(community_member) >= 10
+        if len(community_member) >= min_size
     ]
-    print(f"{len(community_agent_athlete_large)} large (>10) communities")
-
-    community_pairs = combinations(community_agent_athlete_large, 2)
-    for pair_id, (community_1, community_2) in enumerate(community_pairs):
-        community_union = community_1.union(community_2)
-        graph_community = GraphNetworkx(
-            graph_name=f"louvain_community_pair_{pair_id}",
-            graph_content=nx.subgraph(graph_networkx.graph, community_union),
+    print(f"{len(community_agent_athlete_large)} large (>={min_size}) communities")
+
+    # pairs with no edge between them can never be connected, skip them
+    community_pairs = get_adjacent_community_pairs(
+        graph_networkx.graph, community_agent_athlete_large
+    )
+    pair_args = [
+        (
+            (community_id_1, community_id_2),
+            (
+                len(community_agent_athlete_large[community_id_1]),
+                len(community_agent_athlete_large[community_id_2]),
+            ),
+            nx.Graph(
+                graph_networkx.graph.subgraph(
+                    community_agent_athlete_large[community_id_1]
+                    | community_agent_athlete_large[community_id_2]
+                )
+            ),
         )
-        if nx.is_connected(graph_community.graph):
-            agent_athlete_bridge = nx.minimum_edge_cut(graph_community.graph)
-            print(
-                f"community pair {pair_id} with",
-                f"{len(community_1)} + {len(community_2)} = {len(community_union)} members,",
-                f"bridged by {agent_athlete_bridge}",
+        for community_id_1, community_id_2 in community_pairs
+    ]
+    print(f"{len(pair_args)} adjacent community pairs to evaluate")
+    if max_workers <= 1:
+        community_bridges = [find_community_bridge(*args) for args in pair_args]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            community_bridges = list(
+                executor.map(find_community_bridge, *zip(*pair_args))
             )
-            graph_community.draw_graph()
+    return [bridge for bridge in community_bridges if bridge is not None]
 
 
-def analyze():
-    graph_neo4j = GraphNeo4j()
-    graph_networkx = convert_agent_athlete_neo4j_networkx(graph_neo4j)
-    detect_community_agent_athlete(graph_networkx)
+def analyze(backend: str = "networkx", full_recompute: bool = False):
+    with GraphNeo4j() as graph_neo4j:
+        # a full run also rebuilds the snapshot, dropping edges deleted in Neo4j
+        graph_networkx = convert_agent_athlete_snapshot_networkx(
+            graph_neo4j, SNAPSHOT_DIR, full_refresh=full_recompute
+        )
+        community_bridges = detect_community_agent_athlete(
+            graph_networkx,
+            max_workers=os.cpu_count(),
+            backend=backend,
+            graph_neo4j=graph_neo4j,
+            partition_path=PARTITION_PATH,
+            full_recompute=full_recompute,
+        )
+    # layout runs in worker processes while the loop keeps reporting
+    with GraphRenderer(RENDER_DIR, max_workers=os.cpu_count()) as graph_renderer:
+        for community_bridge in community_bridges:
+            community_id_1, community_id_2 = community_bridge.pair_id
+            size_1, size_2 = community_bridge.community_sizes
+            print(
+                f"community pair {community_bridge.pair_id} with",
+                f"{size_1} + {size_2} = {len(community_bridge.members)} members,",
+                f"bridged by {community_bridge.bridge_edges}",
+            )
+            graph_community = GraphNetworkx(
+                graph_name=f"louvain_community_pair_{community_id_1}_{community_id_2}",
+                graph_content=nx.subgraph(
+                    graph_networkx.graph, community_bridge.members
+                ),
+            )
+            graph_renderer.submit(graph_community)
+    print(f"Rendering stats: {graph_renderer.stats}")
 
 
 if __name__ == "__main__":
-    analyze()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--backend",
+        choices=["networkx", "gds"],
+        default="networkx",
+        help="run Louvain in Python or server-side with Graph Data Science",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="rebuild the edge snapshot and rerun Louvain on the whole graph",
+    )
+    args = parser.parse_args()
+    analyze(args.backend, args.full)
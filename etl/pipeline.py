@@ -0,0 +1,152 @@
+import os
+import json
+import queue
+import threading
+from collections.abc import Iterable, Iterator
+from datetime import date
+from itertools import groupby
+from etl.models import GraphSports
+from etl.graphs import GraphNeo4j
+from etl.api_to_json import extract_events
+from etl.graph_store import GraphSportsStore
+from etl.manifest import IngestionManifest
+from etl.instrumentation import span, timed
+from etl.json_to_pydantic import GraphPydanticManual
+from etl.pydantic_to_neo4j import build_graph_batch
+
+
+class CheckpointWriter:
+    def __init__(
+        self, data_dir: str, max_pending: int = 256, graph_format: str = "json"
+    ):
+        self.data_dir = data_dir
+        self.graph_format = graph_format
+        # bounded, so a slow disk slows the pipeline down instead of filling memory
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.errors = []
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # an exception already on its way out is not masked by checkpoint errors
+        self.close(raise_errors=exc_type is None)
+
+    def put_raw_events(self, event_date: date, sports_events: list) -> None:
+        self.pending.put((f"{event_date}/raw_events.json", sports_events))
+
+    def put_graph(self, event_date: date, graph_pydantic_sports: GraphSports) -> None:
+        if self.graph_format == "jsonl":
+            self.pending.put((f"{event_date}", graph_pydantic_sports))
+            return
+        game_id = graph_pydantic_sports.game.id
+        self.pending.put((f"{event_date}/{game_id}.json", graph_pydantic_sports))
+
+    @timed("serialize")
+    def write_checkpoint(self, file_name: str, content: list | GraphSports) -> None:
+        file_path = os.path.join(self.data_dir, file_name)
+        if self.graph_format == "jsonl" and isinstance(content, GraphSports):
+            GraphSportsStore(file_path).append([content])
+            return
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        if isinstance(content, GraphSports):
+            content = content.model_dump()
+        with open(file_path, "w") as file_io:
+            json.dump(content, file_io, indent=2)
+
+    def run(self) -> None:
+        while True:
+            checkpoint = self.pending.get()
+            if checkpoint is None:
+                break
+            try:
+                self.write_checkpoint(*checkpoint)
+            except Exception as write_error:
+                # keep draining, a dead writer would block every later put()
+                print(f"checkpoint {checkpoint[0]} not written: {write_error}")
+                self.errors.append((checkpoint[0], write_error))
+
+    def close(self, raise_errors: bool = True) -> None:
+        self.pending.put(None)
+        self.thread.join()
+        if len(self.errors) == 0:
+            return
+        print(f"{len(self.errors)} checkpoints not written")
+        if raise_errors:
+            file_name, write_error = self.errors[0]
+            raise RuntimeError(
+                f"{len(self.errors)} checkpoints not written, first {file_name}"
+            ) from write_error
+
+
+def stream_events(
+    sports_scoreboards: Iterable[tuple[date, dict]],
+    checkpoint_writer: CheckpointWriter | None = None,
+) -> Iterator[tuple[date, dict]]:
+    for event_date, sports_scoreboard in sports_scoreboards:
+        sports_events = extract_events(sports_scoreboard)
+        if checkpoint_writer is not None and len(sports_events) > 0:
+            checkpoint_writer.put_raw_events(event_date, sports_events)
+        for sports_event in sports_events:
+            yield event_date, sports_event
+
+
+def stream_graphs(
+    dated_events: Iterable[tuple[date, dict]],
+    checkpoint_writer: CheckpointWriter | None = None,
+) -> Iterator[tuple[date, GraphSports]]:
+    graph_pydantic_manual = GraphPydanticManual()
+    for event_date, sports_event in dated_events:
+        with span("transform"):
+            sports_graph_data, transform_error = (
+                graph_pydantic_manual.transform_graph_pydantic_safe(sports_event)
+            )
+        if transform_error is not None:
+            # a malformed event is skipped, the rest of the run goes on
+            event_id = sports_event.get("id")
+            print(
+                f"event {event_id} of {event_date} not transformed: {transform_error}"
+            )
+            continue
+        if checkpoint_writer is not None:
+            checkpoint_writer.put_graph(event_date, sports_graph_data)
+        yield event_date, sports_graph_data
+
+
+def load_graphs(
+    graph_db: GraphNeo4j,
+    dated_graphs: Iterable[tuple[date, GraphSports]],
+    manifest: IngestionManifest | None = None,
+    window_days: int = 7,
+) -> int:
+    # one transaction per day, loaded as soon as the day is transformed
+    num_games = 0
+    for event_date, day_graphs in groupby(dated_graphs, key=lambda dated: dated[0]):
+        sports_graph_data_list = [
+            sports_graph_data for _, sports_graph_data in day_graphs
+        ]
+        print(f"loading {len(sports_graph_data_list)} games of {event_date}")
+        build_graph_batch(graph_db, sports_graph_data_list, manifest, window_days)
+        num_games += len(sports_graph_data_list)
+    return num_games
+
+
+def run_pipeline(
+    graph_db: GraphNeo4j,
+    sports_scoreboards: Iterable[tuple[date, dict]],
+    checkpoint_dir: str | None = None,
+    graph_format: str = "json",
+    manifest: IngestionManifest | None = None,
+    window_days: int = 7,
+) -> int:
+    if checkpoint_dir is None:
+        dated_events = stream_events(sports_scoreboards)
+        return load_graphs(graph_db, stream_graphs(dated_events), manifest, window_days)
+    with CheckpointWriter(
+        checkpoint_dir, graph_format=graph_format
+    ) as checkpoint_writer:
+        dated_events = stream_events(sports_scoreboards, checkpoint_writer)
+        dated_graphs = stream_graphs(dated_events, checkpoint_writer)
+        return load_graphs(graph_db, dated_graphs, manifest, window_days)
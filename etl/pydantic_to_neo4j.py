@@ -1,33 +1,265 @@
 import os
+import argparse
+import asyncio
 import json
 import glob
+import time
 from datetime import date, timedelta
 from dotenv import load_dotenv
 from etl.graphs import GraphNeo4j
+from etl.graphs_async import AsyncGraphNeo4j
 from etl.models import GraphSports
+from etl.graph_store import GraphSportsStore
+from etl.manifest import IngestionManifest, get_manifest_path
+from etl.instrumentation import PROFILE, timed
 
 load_dotenv()
 
 
-def build_graph(graph_db: GraphNeo4j, graph_pydantic_sports: GraphSports):
-    with graph_db.get_db_driver() as driver:
-        graph_db.add_nodes_pydantic(graph_pydantic_sports, driver)
-        graph_db.add_edges_pydantic(graph_pydantic_sports, driver)
+@timed("load")
+def build_graph(
+    graph_db: GraphNeo4j,
+    graph_pydantic_sports: GraphSports,
+    manifest: IngestionManifest | None = None,
+    window_days: int = 7,
+):
+    graph_hashes = None
+    if manifest is not None:
+        changed_graphs, graph_hashes = manifest.filter_graphs([graph_pydantic_sports])
+        if len(changed_graphs) == 0:
+            return
+    driver = graph_db.get_db_driver()
+    graph_db.bootstrap_schema(driver)
+    graph_db.get_team_history(window_days)
+    graph_db.add_nodes_pydantic(graph_pydantic_sports, driver)
+    graph_db.add_edges_pydantic(graph_pydantic_sports, driver)
+    if manifest is not None:
+        manifest.record_graphs(graph_hashes)
 
 
-def generate_graph_from_json(process_date: str, game_id: str = "*") -> None:
-    graph_data = GraphNeo4j()
+@timed("load")
+def build_graph_batch(
+    graph_db: GraphNeo4j,
+    graphs_pydantic_sports: list[GraphSports],
+    manifest: IngestionManifest | None = None,
+    window_days: int = 7,
+) -> int:
+    # with a manifest, only new or changed games are written
+    graph_hashes = None
+    if manifest is not None:
+        graphs_pydantic_sports, graph_hashes = manifest.filter_graphs(
+            graphs_pydantic_sports
+        )
+    if len(graphs_pydantic_sports) == 0:
+        return 0
+    driver = graph_db.get_db_driver()
+    graph_db.bootstrap_schema(driver)
+    graph_db.get_team_history(window_days)
+    num_queries = graph_db.add_graphs_pydantic_batch(graphs_pydantic_sports, driver)
+    # recorded only once the transaction has committed
+    if manifest is not None:
+        manifest.record_graphs(graph_hashes)
+    return num_queries
 
+
+@timed("load")
+async def build_graph_batch_async(
+    graph_db: AsyncGraphNeo4j,
+    graphs_pydantic_sports: list[GraphSports],
+    manifest: IngestionManifest | None = None,
+    window_days: int = 7,
+) -> int:
+    # shared nodes first, then one concurrent transaction per game
+    graph_hashes = None
+    if manifest is not None:
+        graphs_pydantic_sports, graph_hashes = manifest.filter_graphs(
+            graphs_pydantic_sports
+        )
+    if len(graphs_pydantic_sports) == 0:
+        return 0
+    await graph_db.get_team_history(window_days)
+    num_queries, failed_game_ids = await graph_db.add_graphs_pydantic(
+        graphs_pydantic_sports
+    )
+    if manifest is not None:
+        # failed games stay unrecorded, so the next run loads them again
+        for game_id in failed_game_ids:
+            graph_hashes.pop(game_id, None)
+        manifest.record_graphs(graph_hashes)
+    return num_queries
+
+
+class AsyncGraphLoader:
+    # runs build_graph_batch_async for sync callers; the async driver belongs to
+    # one event loop, so the loop lives as long as the writer
+    def __init__(self, max_concurrency: int = 8):
+        self.event_loop = asyncio.new_event_loop()
+        self.graph_db = AsyncGraphNeo4j(max_concurrency=max_concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def build_graph_batch(
+        self,
+        graphs_pydantic_sports: list[GraphSports],
+        manifest: IngestionManifest | None = None,
+        window_days: int = 7,
+    ) -> int:
+        return self.event_loop.run_until_complete(
+            build_graph_batch_async(
+                self.graph_db, graphs_pydantic_sports, manifest, window_days
+            )
+        )
+
+    def close(self) -> None:
+        if self.event_loop.is_closed():
+            return
+        self.event_loop.run_until_complete(self.graph_db.close())
+        self.event_loop.close()
+
+
+def benchmark_build_graph(
+    graph_db: GraphNeo4j, graphs_pydantic_sports: list[GraphSports]
+) -> dict:
+    # both passes start from the same team history and count the round trips
+    # recorded in the run profile, not an estimate
+    team_history = graph_db.get_team_history()
+
+    graph_db.team_history = team_history.copy()
+    num_queries_start = PROFILE.get_query_count()
+    time_start = time.perf_counter()
+    for graph_pydantic_sports in graphs_pydantic_sports:
+        build_graph(graph_db, graph_pydantic_sports)
+    time_per_entity = time.perf_counter() - time_start
+    num_queries_per_entity = PROFILE.get_query_count() - num_queries_start
+
+    graph_db.team_history = team_history.copy()
+    num_queries_start = PROFILE.get_query_count()
+    time_start = time.perf_counter()
+    build_graph_batch(graph_db, graphs_pydantic_sports)
+    time_batch = time.perf_counter() - time_start
+    num_queries_batch = PROFILE.get_query_count() - num_queries_start
+
+    benchmark = {
+        "games": len(graphs_pydantic_sports),
+        "per_entity": {
+            "round_trips": num_queries_per_entity,
+            "seconds": time_per_entity,
+        },
+        "batch": {"round_trips": num_queries_batch, "seconds": time_batch},
+    }
+    print(
+        f"{benchmark['games']} games: ",
+        f"per-entity {num_queries_per_entity} round trips in {time_per_entity:.3f}s, ",
+        f"batch {num_queries_batch} round trips in {time_batch:.3f}s",
+    )
+    return benchmark
+
+
+def generate_graph_from_store(
+    process_date: str,
+    game_id: str,
+    batch: bool,
+    graph_data: GraphNeo4j,
+    manifest: IngestionManifest | None = None,
+    window_days: int = 7,
+    async_loader: AsyncGraphLoader | None = None,
+) -> None:
+    graph_store = GraphSportsStore(f"data/{process_date}")
+    if game_id == "*":
+        pydantic_data_list = list(graph_store.iterate_graphs())
+    else:
+        pydantic_data_list = [graph_store.read_game(game_id)]
+    print(f"processing {len(pydantic_data_list)} games from {graph_store.data_path}")
+    if async_loader is not None:
+        async_loader.build_graph_batch(pydantic_data_list, manifest, window_days)
+        return
+    if batch:
+        build_graph_batch(graph_data, pydantic_data_list, manifest, window_days)
+        return
+    for pydantic_data in pydantic_data_list:
+        build_graph(graph_data, pydantic_data, manifest, window_days)
+
+
+def generate_graph_from_json(
+    process_date: str,
+    game_id: str = "*",
+    batch: bool = False,
+    graph_data: GraphNeo4j | None = None,
+    graph_format: str = "json",
+    manifest: IngestionManifest | None = None,
+    window_days: int = 7,
+    async_loader: AsyncGraphLoader | None = None,
+) -> None:
+    # an async loader always writes the games as one concurrent batch
+    graph_data = GraphNeo4j() if graph_data is None else graph_data
+    batch = batch or async_loader is not None
+    if graph_format == "jsonl":
+        generate_graph_from_store(
+            process_date,
+            game_id,
+            batch,
+            graph_data,
+            manifest,
+            window_days,
+            async_loader,
+        )
+        return
+
+    pydantic_data_list = []
     for file_path in glob.glob(f"data/{process_date}/{game_id}.json"):
-        if os.path.basename(file_path).split(".")[0] == "raw_events":
+        if os.path.basename(file_path).split(".")[0] in ["raw_events", "graphs"]:
             continue
         print(f"processing {file_path}")
         with open(file_path, "r") as input_file:
             input_data = json.load(input_file)
         pydantic_data = GraphSports.model_validate(input_data)
-        build_graph(graph_data, pydantic_data)
+        if batch:
+            pydantic_data_list.append(pydantic_data)
+        else:
+            build_graph(graph_data, pydantic_data, manifest, window_days)
+    if batch and pydantic_data_list and async_loader is not None:
+        async_loader.build_graph_batch(pydantic_data_list, manifest, window_days)
+    elif batch and pydantic_data_list:
+        build_graph_batch(graph_data, pydantic_data_list, manifest, window_days)
 
 
 if __name__ == "__main__":
     yesterday = date.today() - timedelta(days=1)
-    graph_sports = generate_graph_from_json(process_date=str(yesterday))
+    parser = argparse.ArgumentParser(description="Load GraphSports JSON into Neo4j")
+    parser.add_argument(
+        "--force", action="store_true", help="reload games already in the manifest"
+    )
+    parser.add_argument(
+        "--batch", action="store_true", help="write all games in one transaction"
+    )
+    parser.add_argument(
+        "--async-load",
+        action="store_true",
+        help="write the games concurrently, one transaction per game",
+    )
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    args = parser.parse_args()
+    with GraphNeo4j() as graph_neo4j:
+        manifest = None
+        if not args.force:
+            manifest = IngestionManifest(
+                get_manifest_path("data", graph_neo4j.neo4j_uri)
+            )
+        async_loader = None
+        if args.async_load:
+            async_loader = AsyncGraphLoader(args.max_concurrency)
+        generate_graph_from_json(
+            process_date=str(yesterday),
+            batch=args.batch,
+            graph_data=graph_neo4j,
+            manifest=manifest,
+            async_loader=async_loader,
+        )
+        if async_loader is not None:
+            async_loader.close()
+        if manifest is not None:
+            manifest.close()
@@ -1,8 +1,18 @@
 import os
+import argparse
+import asyncio
 import pandas as pd
 from ast import literal_eval
 from dotenv import load_dotenv
 from etl.graphs import GraphNeo4j
+from etl.graphs_async import AsyncGraphNeo4j
+from etl.instrumentation import timed
+from etl.manifest import (
+    IngestionManifest,
+    MANIFEST_KIND_AGENT_ROW,
+    get_manifest_path,
+    hash_agent_row,
+)
 from pandas.core.common import flatten
 
 load_dotenv()
@@ -10,18 +20,22 @@ load_dotenv()
 
 def update_graph_athletes(graph: GraphNeo4j, athlete_list: list) -> None:
     print(f"{len(athlete_list)} athletes")
-    with graph.get_db_driver() as driver:
-        for athlete_name in athlete_list:
-            check_player_exists = graph.match_node_athlete(athlete_name, driver)
-            if not check_player_exists:
-                graph.add_node_athlete(athlete_name, driver)
+    driver = graph.get_db_driver()
+    # existence checks are answered from memory once the index is loaded
+    if graph.athlete_index is None:
+        graph.load_athlete_index()
+    for athlete_name in athlete_list:
+        check_player_exists = graph.match_node_athlete(athlete_name, driver)
+        if not check_player_exists:
+            graph.add_node_athlete(athlete_name, driver)
+    print(graph.athlete_index.stats)
 
 
 def update_graph_agents(graph: GraphNeo4j, agent_list: list) -> None:
     print(f"{len(agent_list)} agents")
-    with graph.get_db_driver() as driver:
-        for agent_name in agent_list:
-            graph.add_node_agent(agent_name, driver)
+    driver = graph.get_db_driver()
+    for agent_name in agent_list:
+        graph.add_node_agent(agent_name, driver)
 
 
 def update_graph_athletes_agents(
@@ -30,13 +44,126 @@ def update_graph_athletes_agents(
     assert len(athlete_list) == len(agent_list)
     num_relations = sum([len(agents) for agents in agent_list])
     print(f"{num_relations} agent -> athlete relations")
-    with graph.get_db_driver() as driver:
-        for athlete_name, agent_names in zip(athlete_list, agent_list):
-            graph.add_edge_agent_athlete(athlete_name, agent_names, driver)
+    driver = graph.get_db_driver()
+    for athlete_name, agent_names in zip(athlete_list, agent_list):
+        graph.add_edge_agent_athlete(athlete_name, agent_names, driver)
 
 
-def update_graph_from_df(athlete_agents_df: pd.DataFrame) -> None:
-    graph_data = GraphNeo4j()
+def update_graph_from_df_bulk(
+    graph: GraphNeo4j, athlete_agents_df: pd.DataFrame, chunk_size: int = 1000
+) -> None:
+    driver = graph.get_db_driver()
+    all_athletes = list(athlete_agents_df["Player"])
+    all_agents = [list(agents) for agents in athlete_agents_df["Agents"]]
+    print(f"{len(all_athletes)} athletes")
+    graph.add_nodes_athlete_bulk(all_athletes, driver, chunk_size)
+    all_agents_unique = list(dict.fromkeys(flatten(all_agents)))
+    print(f"{len(all_agents_unique)} agents")
+    graph.add_nodes_agent_bulk(all_agents_unique, driver, chunk_size)
+    athlete_agents = [
+        {"athlete_name": athlete_name, "agent_names": agent_names}
+        for athlete_name, agent_names in zip(all_athletes, all_agents)
+    ]
+    num_relations = sum([len(agents) for agents in all_agents])
+    print(f"{num_relations} agent -> athlete relations")
+    graph.add_edges_agent_athlete_bulk(athlete_agents, driver, chunk_size)
+
+
+@timed("load")
+async def update_graph_from_df_async(
+    graph: AsyncGraphNeo4j,
+    athlete_agents_df: pd.DataFrame,
+    chunk_size: int = 1000,
+    manifest: IngestionManifest | None = None,
+) -> None:
+    if manifest is not None:
+        athlete_agents_df, row_hashes = filter_changed_agent_rows(
+            athlete_agents_df, manifest
+        )
+        if len(athlete_agents_df) == 0:
+            return
+    await graph.bootstrap_schema()
+    all_athletes = list(athlete_agents_df["Player"])
+    all_agents = [list(agents) for agents in athlete_agents_df["Agents"]]
+    all_agents_unique = list(dict.fromkeys(flatten(all_agents)))
+    print(f"{len(all_athletes)} athletes, {len(all_agents_unique)} agents")
+    # both node sets are independent, edges need them in place
+    await asyncio.gather(
+        graph.add_nodes_athlete_bulk(all_athletes, chunk_size),
+        graph.add_nodes_agent_bulk(all_agents_unique, chunk_size),
+    )
+    athlete_agents = [
+        {"athlete_name": athlete_name, "agent_names": agent_names}
+        for athlete_name, agent_names in zip(all_athletes, all_agents)
+    ]
+    num_relations = sum([len(agents) for agents in all_agents])
+    print(f"{num_relations} agent -> athlete relations")
+    await graph.add_edges_agent_athlete_bulk(athlete_agents, chunk_size)
+    if manifest is not None:
+        manifest.record(MANIFEST_KIND_AGENT_ROW, row_hashes)
+
+
+async def update_graph_from_df_concurrent(
+    athlete_agents_df: pd.DataFrame,
+    max_concurrency: int = 8,
+    chunk_size: int = 1000,
+    force: bool = False,
+) -> None:
+    async with AsyncGraphNeo4j(max_concurrency=max_concurrency) as graph_data:
+        manifest = None
+        if not force:
+            manifest = IngestionManifest(
+                get_manifest_path("data", graph_data.neo4j_uri)
+            )
+        await update_graph_from_df_async(
+            graph_data, athlete_agents_df, chunk_size, manifest
+        )
+        if manifest is not None:
+            manifest.close()
+
+
+def filter_changed_agent_rows(
+    athlete_agents_df: pd.DataFrame, manifest: IngestionManifest
+) -> tuple[pd.DataFrame, dict[str, str]]:
+    row_hashes = {
+        athlete_name: hash_agent_row(athlete_name, list(agent_names))
+        for athlete_name, agent_names in zip(
+            athlete_agents_df["Player"], athlete_agents_df["Agents"]
+        )
+    }
+    changed_keys = manifest.filter_changed(MANIFEST_KIND_AGENT_ROW, row_hashes)
+    changed_df = athlete_agents_df[athlete_agents_df["Player"].isin(changed_keys)]
+    print(f"{len(changed_df)} of {len(athlete_agents_df)} agent rows new or changed")
+    return changed_df, {key: row_hashes[key] for key in changed_keys}
+
+
+@timed("load")
+def update_graph_from_df(
+    athlete_agents_df: pd.DataFrame,
+    graph_data: GraphNeo4j | None = None,
+    bulk: bool = True,
+    chunk_size: int = 1000,
+    manifest: IngestionManifest | None = None,
+) -> None:
+    graph_data = GraphNeo4j() if graph_data is None else graph_data
+    if manifest is not None:
+        athlete_agents_df, row_hashes = filter_changed_agent_rows(
+            athlete_agents_df, manifest
+        )
+        if len(athlete_agents_df) == 0:
+            return
+    graph_data.bootstrap_schema(graph_data.get_db_driver())
+    if bulk:
+        update_graph_from_df_bulk(graph_data, athlete_agents_df, chunk_size)
+    else:
+        update_graph_from_df_per_row(graph_data, athlete_agents_df)
+    if manifest is not None:
+        manifest.record(MANIFEST_KIND_AGENT_ROW, row_hashes)
+
+
+def update_graph_from_df_per_row(
+    graph_data: GraphNeo4j, athlete_agents_df: pd.DataFrame
+) -> None:
     # Add Node: athletes
     all_athletes = athlete_agents_df["Player"]
     update_graph_athletes(graph_data, all_athletes)
@@ -53,4 +180,30 @@ if __name__ == "__main__":
         f"data/nba_agents_2025-03-22.csv",
         converters={"Agents": literal_eval},
     )
-    update_graph_from_df(nba_agents_df)
+    parser = argparse.ArgumentParser(description="Load the agents table into Neo4j")
+    parser.add_argument(
+        "--force", action="store_true", help="reload rows already in the manifest"
+    )
+    parser.add_argument(
+        "--async-load",
+        action="store_true",
+        help="write athletes and agents concurrently",
+    )
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    args = parser.parse_args()
+    if args.async_load:
+        asyncio.run(
+            update_graph_from_df_concurrent(
+                nba_agents_df, args.max_concurrency, force=args.force
+            )
+        )
+    else:
+        with GraphNeo4j() as graph_neo4j:
+            manifest = None
+            if not args.force:
+                manifest = IngestionManifest(
+                    get_manifest_path("data", graph_neo4j.neo4j_uri)
+                )
+            update_graph_from_df(nba_agents_df, graph_neo4j, manifest=manifest)
+            if manifest is not None:
+                manifest.close()
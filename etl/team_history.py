@@ -0,0 +1,95 @@
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from datetime import date
+
+
+def get_day(date_string: str) -> date:
+    return date.fromisoformat(date_string[:10])
+
+
+def build_team_change_rows(athlete_id: int, stints: list[dict]) -> list[dict]:
+    # stints in first_date order, one per team; a return to an earlier team
+    # shares that team's edge, so only the first move there can be recovered
+    return [
+        {
+            "athlete_id": athlete_id,
+            "from_team_id": stint_from["team_id"],
+            "to_team_id": stint_to["team_id"],
+            "date": stint_to["first_date"],
+        }
+        for stint_from, stint_to in zip(stints, stints[1:])
+        if stint_from["team_id"] != stint_to["team_id"]
+    ]
+
+
+@dataclass
+class TeamHistoryPlan:
+    # compete_for rows still worth writing, team changes, and the state to commit
+    rows: list[dict] = field(default_factory=list)
+    changes: list[dict] = field(default_factory=list)
+    updates: dict[int, tuple[int, str]] = field(default_factory=dict)
+    num_skipped: int = 0
+
+
+class TeamHistoryIndex:
+    def __init__(self, window_days: int = 7):
+        # athlete id -> (current team id, last date written to compete_for)
+        self.window_days = window_days
+        self.current_teams = {}
+        self.stats = {"written": 0, "skipped": 0, "changes": 0}
+
+    def __len__(self):
+        return len(self.current_teams)
+
+    def __str__(self):
+        return f"Team history of {len(self.current_teams)} athletes"
+
+    def copy(self) -> "TeamHistoryIndex":
+        team_history = TeamHistoryIndex(self.window_days)
+        team_history.current_teams = dict(self.current_teams)
+        return team_history
+
+    def load(self, current_teams: Iterable[tuple[int, int, str]]) -> int:
+        for athlete_id, team_id, last_date in current_teams:
+            self.current_teams[athlete_id] = (team_id, last_date)
+        return len(self.current_teams)
+
+    def plan(self, compete_for_rows: list[dict]) -> TeamHistoryPlan:
+        # nothing is changed here, so a retried transaction can plan again
+        team_plan = TeamHistoryPlan()
+        for row in sorted(compete_for_rows, key=lambda row: row["date"]):
+            athlete_id = row["from_node_id"]
+            team_id = row["to_node_id"]
+            current_team = team_plan.updates.get(
+                athlete_id, self.current_teams.get(athlete_id)
+            )
+            if current_team is None:
+                team_plan.updates[athlete_id] = (team_id, row["date"])
+            elif get_day(row["date"]) < get_day(current_team[1]):
+                # backfilled game older than what is known, written as before
+                pass
+            elif team_id != current_team[0]:
+                team_plan.changes.append(
+                    {
+                        "athlete_id": athlete_id,
+                        "from_team_id": current_team[0],
+                        "to_team_id": team_id,
+                        "date": row["date"],
+                    }
+                )
+                team_plan.updates[athlete_id] = (team_id, row["date"])
+            elif (
+                get_day(row["date"]) - get_day(current_team[1])
+            ).days < self.window_days:
+                team_plan.num_skipped += 1
+                continue
+            else:
+                team_plan.updates[athlete_id] = (team_id, row["date"])
+            team_plan.rows.append(row)
+        return team_plan
+
+    def commit(self, team_plan: TeamHistoryPlan) -> None:
+        self.current_teams.update(team_plan.updates)
+        self.stats["written"] += len(team_plan.rows)
+        self.stats["skipped"] += team_plan.num_skipped
+        self.stats["changes"] += len(team_plan.changes)
@@ -3,12 +3,20 @@ import requests
 import pandas as pd
 from datetime import date
 from dotenv import load_dotenv
+from etl.http_cache import ResponseCache
 
 load_dotenv()
 
 
-def get_nba_agents_table() -> pd.DataFrame:
-    nba_agents_html = requests.get(os.getenv("NBA_AGENTS_URL")).content
+def get_nba_agents_table(
+    response_cache: ResponseCache | None = None, max_age: float = 24 * 3600
+) -> pd.DataFrame:
+    if response_cache is not None:
+        nba_agents_html = response_cache.get(
+            url=os.getenv("NBA_AGENTS_URL"), max_age=max_age
+        )
+    else:
+        nba_agents_html = requests.get(os.getenv("NBA_AGENTS_URL")).content
     nba_agents_dfs = pd.read_html(nba_agents_html)
     assert len(nba_agents_dfs) == 1
     nba_agents_df = nba_agents_dfs[0]